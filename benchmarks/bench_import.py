@@ -0,0 +1,82 @@
+"""
+Cold-start import time of the UAVision modules.
+
+Every sample imports the module in a fresh interpreter, so the numbers match
+the start-up cost of short-lived per-flight worker processes. The import time
+of numpy and pandas alone is reported as baseline.
+
+usage: python benchmarks/bench_import.py [--repeat 10] [--output import.json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "UAVision",
+    "UAVision.bme.preprocess",
+    "UAVision.cpc.preprocess",
+    "UAVision.mavic.preprocess",
+    "UAVision.mcda.preprocess",
+    "UAVision.pops.preprocess",
+]
+
+_CODE = """
+import time
+t = time.perf_counter()
+import {module}
+print(time.perf_counter() - t)
+"""
+_BASELINE = "numpy, pandas"
+
+
+def import_time(module: str, repeat: int) -> dict[str, float]:
+    """
+    Import a module in fresh interpreters
+    module: module name (string)
+    repeat: number of fresh interpreters
+    return: dict of min, median and max import time (s)
+    """
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _CODE.format(module=module)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+    }
+
+
+def run(repeat: int = 10) -> dict[str, dict[str, float]]:
+    """
+    Import time of numpy + pandas (baseline) and of each UAVision module
+    repeat: number of fresh interpreters per module
+    return: dict of module name and import time statistics (s)
+    """
+    results = {"baseline (numpy, pandas)": import_time(_BASELINE, repeat)}
+    for module in MODULES:
+        results[module] = import_time(module, repeat)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start import benchmark")
+    parser.add_argument("--repeat", help="Samples per module", type=int, default=10)
+    parser.add_argument("--output", help="Json output file", type=str, default=None)
+    argument = parser.parse_args()
+
+    results = run(argument.repeat)
+    text = json.dumps(results, indent=1)
+    if argument.output is None:
+        print(text)
+    else:
+        with open(argument.output, "w") as fh:
+            fh.write(text)
@@ -0,0 +1,581 @@
+"""
+Time and peak memory of the UAVision entry points on synthetic logs.
+
+Inputs are generated once per scale by generators.py into the work directory
+and reused by later runs. Each benchmark is timed repeat times (min and median
+of time.perf_counter) and run once more under tracemalloc for the peak of the
+Python and numpy allocations. Results are written as json, and a previous
+result file can be given to print the ratios against it. Runs offline.
+
+usage: python benchmarks/bench_suite.py [--scales 1min,1h,10h] [--repeat 3]
+                                        [--only mcda] [--output results.json]
+                                        [--compare baseline.json] [--imports]
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+import generators
+
+SCALES = {"1min": 60, "1h": 3600, "10h": 36000}
+WORKDIR = os.path.join(tempfile.gettempdir(), "uavision_bench")
+
+Setup = Callable[[dict[str, str], str], Callable[[], Any]]
+BENCHMARKS: dict[str, Setup] = {}
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    """
+    Register a benchmark. The setup function gets the input paths and a
+    scratch directory and returns the function that is measured.
+    """
+
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _consume(iterator: Any) -> int:
+    return sum(len(x) for x in iterator)
+
+
+@benchmark("cpc.preprocess_cpc")
+def _cpc_preprocess_cpc(paths, scratch):
+    from UAVision.cpc.preprocess import preprocess_cpc
+
+    return lambda: preprocess_cpc(paths["cpc"])
+
+
+@benchmark("bme.preprocess_bme")
+def _bme_preprocess_bme(paths, scratch):
+    from UAVision.bme.preprocess import preprocess_bme
+
+    return lambda: preprocess_bme(paths["bme"])
+
+
+@benchmark("bme.iter_preprocess_bme")
+def _bme_iter_preprocess_bme(paths, scratch):
+    from UAVision.bme.preprocess import iter_preprocess_bme
+
+    return lambda: _consume(iter_preprocess_bme(paths["bme"], chunksize=1000))
+
+
+@benchmark("pops.preprocess_pops")
+def _pops_preprocess_pops(paths, scratch):
+    from UAVision.pops.preprocess import preprocess_pops
+
+    return lambda: preprocess_pops(paths["pops"])
+
+
+@benchmark("pops.preprocess_pops_compact")
+def _pops_preprocess_pops_compact(paths, scratch):
+    from UAVision.pops.preprocess import preprocess_pops
+
+    return lambda: preprocess_pops(paths["pops"], compact=True, include_dndlog=False)
+
+
+@benchmark("mcda.preprocess_mcda")
+def _mcda_preprocess_mcda(paths, scratch):
+    from UAVision.mcda.preprocess import preprocess_mcda
+
+    return lambda: preprocess_mcda(paths["mcda"], "water_0.6-40")
+
+
+@benchmark("mcda.preprocess_mcda_compact")
+def _mcda_preprocess_mcda_compact(paths, scratch):
+    from UAVision.mcda.preprocess import preprocess_mcda
+
+    return lambda: preprocess_mcda(
+        paths["mcda"], "water_0.6-40", compact=True, include_dndlog=False
+    )
+
+
+@benchmark("mcda.iter_preprocess_mcda")
+def _mcda_iter_preprocess_mcda(paths, scratch):
+    from UAVision.mcda.preprocess import iter_preprocess_mcda
+
+    return lambda: _consume(
+        iter_preprocess_mcda(paths["mcda"], "water_0.6-40", chunksize=1000)
+    )
+
+
+@benchmark("mcda.preprocess_mcda_to_csv")
+def _mcda_preprocess_mcda_to_csv(paths, scratch):
+    from UAVision.mcda.preprocess import preprocess_mcda_to_csv
+
+    file_out = os.path.join(scratch, "mcda_out.csv")
+    return lambda: preprocess_mcda_to_csv(
+        paths["mcda"], "water_0.6-40", file_out, chunksize=1000
+    )
+
+
+@benchmark("mcda.decode_hex_counts")
+def _mcda_decode_hex_counts(paths, scratch):
+    from UAVision.mcda.preprocess import decode_hex_counts
+
+    values = pd.read_csv(paths["mcda"], skiprows=1, header=None, dtype=str)
+    values = values.iloc[:, 1:257].to_numpy()
+    return lambda: decode_hex_counts(values)
+
+
+@benchmark("mcda.mcda_moments")
+def _mcda_mcda_moments(paths, scratch):
+    from UAVision.mcda.preprocess import decode_hex_counts, mcda_moments
+    from UAVision.bins import get_bin_geometry
+
+    values = pd.read_csv(paths["mcda"], skiprows=1, header=None, dtype=str)
+    counts = decode_hex_counts(values.iloc[:, 1:257].to_numpy())
+    geometry = get_bin_geometry("mcda", "water_0.6-40")
+    return lambda: mcda_moments(counts, geometry)
+
+
+def _mcda_with_rh(paths: dict[str, str]) -> pd.DataFrame:
+    from UAVision.mcda.preprocess import preprocess_mcda
+
+    df = preprocess_mcda(paths["mcda"], "water_0.6-40")
+    rng = np.random.default_rng(0)
+    return df.assign(**{"rh_bme (%)": rng.uniform(50, 100, len(df))})
+
+
+@benchmark("mcda.cloudmask")
+def _mcda_cloudmask(paths, scratch):
+    from UAVision.mcda.preprocess import cloudmask
+
+    df = _mcda_with_rh(paths)
+    return lambda: cloudmask(df)
+
+
+@benchmark("mcda.cloudmask_array")
+def _mcda_cloudmask_array(paths, scratch):
+    from UAVision.mcda.preprocess import cloudmask_array
+
+    df = _mcda_with_rh(paths)
+    conc = df[[f"bin{x}_mcda (cm-3)" for x in range(1, 257)]].to_numpy()
+    datetime = df["datetime"].to_numpy()
+    rh = df["rh_bme (%)"].to_numpy()
+    return lambda: cloudmask_array(conc, datetime, rh)
+
+
+def _opc_frame(paths: dict[str, str]) -> pd.DataFrame:
+    # OPC-N3 like frame from the pops bin counts
+    df = pd.read_csv(paths["pops"])
+    bins = df[[f"b{i}" for i in range(16)]].to_numpy(dtype=float)
+    data = np.concatenate([bins, bins[:, :8]], axis=1)
+    opc = pd.DataFrame(data, columns=[f"bin{i}" for i in range(24)])
+    opc["flow"] = df[" POPS_Flow"].to_numpy() * 100
+    opc["period"] = df[" Temp"].to_numpy() * 10
+    return opc
+
+
+@benchmark("mavic.calculate_concentration")
+def _mavic_calculate_concentration(paths, scratch):
+    from UAVision.mavic.preprocess import calculate_concentration
+
+    opc = _opc_frame(paths)
+    bins = [f"bin{i}" for i in range(24)]
+    return lambda: calculate_concentration(opc, bins, "flow", "period")
+
+
+@benchmark("mavic.calculate_concentration_array")
+def _mavic_calculate_concentration_array(paths, scratch):
+    from UAVision.mavic.preprocess import calculate_concentration_array
+
+    opc = _opc_frame(paths)
+    # the same sensor stacked 24 times, computed in place
+    counts = np.stack([opc[[f"bin{i}" for i in range(24)]].to_numpy()] * 24)
+    flow = np.stack([opc["flow"].to_numpy()] * 24)
+    period = np.stack([opc["period"].to_numpy()] * 24)
+    buffer = np.empty((2, *counts.shape))
+
+    def run():
+        buffer[0] = counts
+        return calculate_concentration_array(buffer[0], "opcn3", flow, period, buffer)
+
+    return run
+
+
+def _lag_frame(paths: dict[str, str]) -> pd.DataFrame:
+    from UAVision.bme.preprocess import preprocess_bme
+    from UAVision.cpc.preprocess import preprocess_cpc
+
+    bme = preprocess_bme(paths["bme"])
+    cpc = preprocess_cpc(paths["cpc"])
+    return bme.merge(cpc, on="datetime", how="outer")
+
+
+@benchmark("mavic.calculate_lag")
+def _mavic_calculate_lag(paths, scratch):
+    from UAVision.mavic.preprocess import calculate_lag
+
+    df = _lag_frame(paths)
+    return lambda: calculate_lag(df, "press_bme (hPa)", "press_cpc (hPa)", 30)
+
+
+@benchmark("mavic.calculate_lag_fft")
+def _mavic_calculate_lag_fft(paths, scratch):
+    from UAVision.mavic.preprocess import calculate_lag
+
+    df = _lag_frame(paths)
+    return lambda: calculate_lag(
+        df, "press_bme (hPa)", "press_cpc (hPa)", 30, method="fft"
+    )
+
+
+@benchmark("mavic.calculate_lag_batch")
+def _mavic_calculate_lag_batch(paths, scratch):
+    from UAVision.mavic.preprocess import calculate_lag_batch
+
+    df = _lag_frame(paths)
+    variables = [
+        "press_cpc (hPa)",
+        "temp_bme (C)",
+        "rh_bme (%)",
+        "N_conc_cpc (cm-3)",
+    ]
+    return lambda: calculate_lag_batch(df, "press_bme (hPa)", variables, 30)
+
+
+@benchmark("utils.resample_sparse")
+def _utils_resample_sparse(paths, scratch):
+    from UAVision.utils import resample_sparse
+
+    df = pd.read_csv(paths["pops"])
+    df["datetime"] = pd.to_datetime(df["DateTime"], unit="s")
+    # the same rows spread over three days, as flights with long gaps between
+    df["datetime"] += pd.to_timedelta(np.arange(len(df)) // 3600, unit="D")
+    return lambda: resample_sparse(df)
+
+
+@benchmark("fusion.fuse")
+def _fusion_fuse(paths, scratch):
+    from UAVision.bme.preprocess import preprocess_bme
+    from UAVision.cpc.preprocess import preprocess_cpc
+    from UAVision.fusion import fuse
+    from UAVision.mcda.preprocess import preprocess_mcda
+    from UAVision.pops.preprocess import preprocess_pops
+
+    products = {
+        "mcda": preprocess_mcda(paths["mcda"], "water_0.6-40"),
+        "bme": preprocess_bme(paths["bme"]),
+        "cpc": preprocess_cpc(paths["cpc"]),
+        "pops": preprocess_pops(paths["pops"]),
+    }
+    return lambda: fuse(
+        products,
+        base="mcda",
+        tolerance="1s",
+        lags={"cpc": 2},
+        columns={"cpc": ["N_conc_cpc (cm-3)", "press_cpc (hPa)"]},
+    )
+
+
+@benchmark("profiles.vertical_profile")
+def _profiles_vertical_profile(paths, scratch):
+    from UAVision.bme.preprocess import preprocess_bme
+    from UAVision.fusion import fuse
+    from UAVision.mcda.preprocess import preprocess_mcda
+    from UAVision.profiles import vertical_profile
+
+    df = fuse(
+        {
+            "mcda": preprocess_mcda(paths["mcda"], "water_0.6-40"),
+            "bme": preprocess_bme(paths["bme"]),
+        },
+        base="mcda",
+        tolerance="1s",
+    )
+    conc = [f"bin{x}_mcda (cm-3)" for x in range(1, 257)]
+    return lambda: vertical_profile(df, conc, bins=10.0, percentiles=(10, 90))
+
+
+@benchmark("mavic.merge_sensor_data")
+def _mavic_merge_sensor_data(paths, scratch):
+    from UAVision.mavic.merge_sensor_data import merge_sensor_data
+
+    dir_out = os.path.join(scratch, "merged")
+    os.makedirs(dir_out, exist_ok=True)
+    return lambda: merge_sensor_data(paths["sensor_tree"], dir_out)
+
+
+@benchmark("mavic.merge_wind_data")
+def _mavic_merge_wind_data(paths, scratch):
+    from UAVision.mavic.merge_wind_data import merge_wind_data
+
+    dir_out = os.path.join(scratch, "wind")
+    os.makedirs(dir_out, exist_ok=True)
+    return lambda: merge_wind_data(paths["wind"], dir_out)
+
+
+@benchmark("columnar.save_columnar")
+def _columnar_save_columnar(paths, scratch):
+    from UAVision.columnar import save_columnar
+    from UAVision.mcda.preprocess import preprocess_mcda
+
+    df = preprocess_mcda(paths["mcda"], "water_0.6-40")
+    return lambda: save_columnar(df, os.path.join(scratch, "mcda.npy"), "npy")
+
+
+@benchmark("columnar.load_columnar")
+def _columnar_load_columnar(paths, scratch):
+    from UAVision.columnar import load_columnar, save_columnar
+    from UAVision.mcda.preprocess import preprocess_mcda
+
+    df = preprocess_mcda(paths["mcda"], "water_0.6-40")
+    path = save_columnar(df, os.path.join(scratch, "mcda_load.npy"), "npy")
+    return lambda: load_columnar(path, mmap=False)
+
+
+@benchmark("catalog.query")
+def _catalog_query(paths, scratch):
+    from UAVision.catalog import FlightCatalog
+
+    catalog = FlightCatalog()
+    catalog.add(paths["bme"], "bme")
+    catalog.add(paths["cpc"], "cpc")
+    start = generators.START
+    end = start + pd.Timedelta(minutes=30)
+    return lambda: catalog.query(start, end, ["bme", "cpc"])
+
+
+def _max_relative_error(compact: pd.DataFrame, full: pd.DataFrame) -> float:
+    # largest |x32 - x64| / |x64| over the float columns, 0 / 0 counted as 0
+    error = 0.0
+    for name in full.columns:
+        if full[name].dtype != np.float64:
+            continue
+        x = full[name].to_numpy()
+        diff = np.abs(compact[name].to_numpy(dtype=np.float64) - x)
+        ok = ~np.isnan(x)
+        if not np.array_equal(np.isnan(x), np.isnan(diff)):
+            return np.inf
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(diff[ok] == 0, 0, diff[ok] / np.abs(x[ok]))
+        error = max(error, float(ratio.max(initial=0)))
+    return error
+
+
+def check_compact(paths: dict[str, str], scratch: str) -> dict[str, dict[str, float]]:
+    """
+    Largest relative error of the compact=True outputs against float64 and the
+    documented bound, an AssertionError is raised when a bound is exceeded
+    paths: generated inputs of one scale
+    scratch: directory for merge outputs
+    return: dict of output name and its error and bound
+    """
+    from UAVision.bme.preprocess import preprocess_bme
+    from UAVision.cpc.preprocess import preprocess_cpc
+    from UAVision.mavic.merge_sensor_data import merge_sensor_data
+    from UAVision.mcda.preprocess import dndlog_mcda, preprocess_mcda
+    from UAVision.pops.preprocess import dndlog_pops, preprocess_pops
+    from UAVision.utils import FLOAT32_RTOL
+
+    size = "water_0.6-40"
+    mcda = preprocess_mcda(paths["mcda"], size)
+    mcda32 = preprocess_mcda(paths["mcda"], size, compact=True, include_dndlog=False)
+    pops = preprocess_pops(paths["pops"])
+    pops32 = preprocess_pops(paths["pops"], compact=True, include_dndlog=False)
+    dndlog_label = [x for x in mcda.columns if "dN/dlogDp" in x]
+    pops_dndlog_label = [x for x in pops.columns if "dN/dlogDp" in x]
+    cpc = preprocess_cpc(paths["cpc"])
+    cpc32 = preprocess_cpc(paths["cpc"], compact=True)
+    bme = preprocess_bme(paths["bme"])
+    bme32 = preprocess_bme(paths["bme"], compact=True)
+    pairs = {
+        "cpc": (cpc32, cpc, 1),
+        "bme": (bme32, bme, 1),
+        "pops": (pops32, pops.drop(columns=pops_dndlog_label), 1),
+        "pops.dndlog_pops": (dndlog_pops(pops32), pops[pops_dndlog_label], 2),
+        "mcda": (mcda32, mcda.drop(columns=dndlog_label), 1),
+        "mcda.dndlog_mcda": (dndlog_mcda(mcda32, size), mcda[dndlog_label], 2),
+    }
+    merged = {}
+    for compact in (False, True):
+        dir_out = os.path.join(scratch, f"merged_{compact}")
+        os.makedirs(dir_out, exist_ok=True)
+        merge_sensor_data(paths["sensor_tree"], dir_out, compact=compact)
+        merged[compact] = pd.concat(
+            [pd.read_csv(os.path.join(dir_out, x)) for x in sorted(os.listdir(dir_out))]
+        )
+    pairs["merge_sensor_data (csv)"] = (merged[True], merged[False], 2)
+
+    results = {}
+    for name, (small, full, factor) in pairs.items():
+        # products of rounding errors are allowed for in the bound
+        bound = factor * FLOAT32_RTOL * (1 + 1e-6)
+        error = _max_relative_error(small, full)
+        results[name] = {"max_relative_error": error, "bound": bound}
+        assert error <= bound, f"{name}: relative error {error} above {bound}"
+    return results
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """
+    Time and peak memory of a function
+    fn: function without arguments
+    repeat: number of timed runs
+    return: dict of min and median time (s) and tracemalloc peak (MB)
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "time_min": min(times),
+        "time_median": statistics.median(times),
+        "peak_mb": peak / 1e6,
+    }
+
+
+def run(
+    scales: list[str],
+    repeat: int = 3,
+    only: str | None = None,
+    workdir: str | None = None,
+) -> dict[str, Any]:
+    """
+    Run the benchmarks at the given scales
+    scales: list of keys of SCALES
+    repeat: number of timed runs per benchmark
+    only: optional regex, only benchmarks with a matching name are run
+    workdir: directory of the generated inputs, kept between runs
+    return: dict of run metadata and results per scale and benchmark
+    """
+    import UAVision
+
+    if workdir is None:
+        workdir = WORKDIR
+    names = [x for x in BENCHMARKS if only is None or re.search(only, x)]
+    results: dict[str, dict[str, dict[str, float]]] = {}
+    for scale in scales:
+        paths = generators.generate(workdir, SCALES[scale])
+        results[scale] = {}
+        for name in names:
+            scratch = tempfile.mkdtemp(dir=workdir)
+            try:
+                fn = BENCHMARKS[name](paths, scratch)
+                results[scale][name] = measure(fn, repeat)
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            result = results[scale][name]
+            print(
+                f"{scale:>5} {name:<32} {result['time_median']:9.4f} s "
+                f"{result['peak_mb']:9.1f} MB",
+                file=sys.stderr,
+            )
+    return {
+        "meta": {
+            "UAVision": UAVision.__version__,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "repeat": repeat,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> str:
+    """
+    Ratio of time and peak memory against a baseline result file
+    results: output of run
+    baseline: output of an earlier run
+    return: text table, ratios above 1 are slower or larger
+    """
+    lines = [f"{'scale':>5} {'benchmark':<32} {'time':>7} {'memory':>7}"]
+    for scale, benchmarks in results["results"].items():
+        for name, new in benchmarks.items():
+            old = baseline["results"].get(scale, {}).get(name)
+            if old is None:
+                continue
+            lines.append(
+                f"{scale:>5} {name:<32} "
+                f"{new['time_median'] / old['time_median']:7.2f} "
+                f"{new['peak_mb'] / max(old['peak_mb'], 1e-6):7.2f}"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UAVision benchmark suite")
+    parser.add_argument(
+        "--scales", help="Comma separated scales", type=str, default="1min,1h,10h"
+    )
+    parser.add_argument(
+        "--repeat", help="Timed runs per benchmark", type=int, default=3
+    )
+    parser.add_argument(
+        "--only", help="Regex of benchmark names", type=str, default=None
+    )
+    parser.add_argument(
+        "--workdir", help="Directory of the inputs", type=str, default=None
+    )
+    parser.add_argument("--output", help="Json output file", type=str, default=None)
+    parser.add_argument(
+        "--compare", help="Json file of a baseline run", type=str, default=None
+    )
+    parser.add_argument(
+        "--check-compact",
+        help="Check the compact=True outputs against their error bounds",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--imports", help="Also run the cold import benchmark", action="store_true"
+    )
+    argument = parser.parse_args()
+
+    results = run(
+        argument.scales.split(","), argument.repeat, argument.only, argument.workdir
+    )
+    if argument.check_compact:
+        scratch = tempfile.mkdtemp()
+        try:
+            results["compact"] = {
+                x: check_compact(
+                    generators.generate(argument.workdir or WORKDIR, SCALES[x]),
+                    os.path.join(scratch, x),
+                )
+                for x in argument.scales.split(",")
+            }
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    if argument.imports:
+        import bench_import
+
+        results["imports"] = bench_import.run()
+    text = json.dumps(results, indent=1)
+    if argument.output is None:
+        print(text)
+    else:
+        with open(argument.output, "w") as fh:
+            fh.write(text)
+    if argument.compare is not None:
+        with open(argument.compare) as fh:
+            print(compare(results, json.load(fh)))
@@ -0,0 +1,260 @@
+"""
+Deterministic synthetic instrument logs for the benchmarks.
+
+Every generator takes the logged duration in seconds and a seed, and writes
+files in the layout read by the UAVision preprocess functions. The same
+duration and seed always give the same bytes.
+"""
+
+import os
+from os import PathLike
+
+import numpy as np
+import pandas as pd
+
+START = pd.Timestamp("2023-05-01 10:00:00")
+
+POPS_AUX = [
+    " Status",
+    " PartCt",
+    " PartCon",
+    " BL",
+    " BLTH",
+    " STD",
+    " P",
+    " TofP",
+    " POPS_Flow",
+    " PumpFB",
+    " LDTemp",
+    " LaserFB",
+    " LD_Mon",
+    " Temp",
+    " BatV",
+    " Laser_Current",
+    " Flow_Set",
+    "PumpLife_hrs",
+    " BL_Start",
+    " TH_Mult",
+    " nbins",
+    " logmin",
+    " logmax",
+    " Skip_Save",
+    " MinPeakPts",
+    "MaxPeakPts",
+    " RawPts",
+]
+
+
+def _pressure(rng: np.random.Generator, n: int) -> np.ndarray:
+    # slow ascent and descent around 1000 hPa
+    return 1000 - 30 * np.sin(np.linspace(0, np.pi, n)) + rng.normal(0, 0.05, n)
+
+
+def cpc(
+    path: str | PathLike[str], duration: int, seed: int = 0, start: pd.Timestamp = START
+) -> None:
+    """
+    CPC log at 1 Hz
+    path: output csv file
+    duration: logged seconds
+    seed: random seed
+    start: first timestamp
+    """
+    rng = np.random.default_rng(seed)
+    t = pd.date_range(start, periods=duration, freq="1s")
+    df = pd.DataFrame(
+        {
+            "date_time": t.strftime("%Y-%m-%d %H:%M:%S"),
+            "N conc(1/ccm)": rng.uniform(0, 5000, duration).round(1),
+            "Pressure (hPa)": _pressure(rng, duration).round(2),
+            "Flow": rng.normal(0.3, 0.01, duration).round(3),
+        }
+    )
+    df.loc[::50, "N conc(1/ccm)"] = 0
+    df.to_csv(path, index=False)
+
+
+def bme(
+    path: str | PathLike[str], duration: int, seed: int = 0, start: pd.Timestamp = START
+) -> None:
+    """
+    BME log at 1 Hz with split date and time columns
+    """
+    rng = np.random.default_rng(seed)
+    t = pd.date_range(start, periods=duration, freq="1s")
+    df = pd.DataFrame(
+        {
+            "date": t.strftime("%Y-%m-%d"),
+            "time": t.strftime("%H:%M:%S"),
+            "temp_bme": rng.normal(10, 1, duration).round(2),
+            "press_bme": _pressure(rng, duration).round(2),
+            "rh_bme": rng.uniform(20, 100, duration).round(1),
+        }
+    )
+    df.to_csv(path, index=False)
+
+
+def pops(
+    path: str | PathLike[str], duration: int, seed: int = 0, start: pd.Timestamp = START
+) -> None:
+    """
+    POPS log at about 2 Hz with epoch seconds and 16 bin counts
+    """
+    rng = np.random.default_rng(seed)
+    n = 2 * duration
+    data: dict[str, np.ndarray] = {
+        "DateTime": pd.Timestamp(start).timestamp()
+        + np.arange(n) * 0.5
+        + rng.uniform(0, 0.1, n)
+    }
+    for x in POPS_AUX:
+        data[x] = rng.uniform(1, 10, n).round(3)
+    for i in range(16):
+        data[f"b{i}"] = rng.poisson(5, n)
+    pd.DataFrame(data).to_csv(path, index=False)
+
+
+def mcda(
+    path: str | PathLike[str], duration: int, seed: int = 0, start: pd.Timestamp = START
+) -> None:
+    """
+    mCDA log at 1 Hz, 256 hex encoded bin counts and 9 trailing columns
+    """
+    rng = np.random.default_rng(seed)
+    t = pd.date_range(start, periods=duration, freq="1s").strftime("%Y%m%d%H%M%S")
+    counts = rng.poisson(
+        rng.uniform(0, 3, 256) * (np.arange(256) < 200), size=(duration, 256)
+    )
+    counts[::7] = 0
+    hexes = np.array([format(x, "X") for x in range(counts.max() + 1)])[counts]
+    pm = rng.integers(0, 50, (duration, 6)).astype(str)
+    with open(path, "w") as fh:
+        fh.write("mcda synthetic log\n")
+        fh.writelines(
+            ",".join([t[i], *hexes[i], "1", "2", "3", *pm[i]]) + "\n"
+            for i in range(duration)
+        )
+
+
+def sensor_tree(
+    root: str | PathLike[str],
+    duration: int,
+    seed: int = 0,
+    flight_duration: int = 1800,
+    start: pd.Timestamp = START,
+) -> None:
+    """
+    Mavic sensor folders for merge_sensor_data, one folder per flight of at most
+    flight_duration seconds, each with BME and OPC files at 2 Hz in two parts
+    and GPS at 0.5 Hz
+    root: output directory
+    """
+    rng = np.random.default_rng(seed)
+    n_flights = max(1, -(-duration // flight_duration))
+    for k in range(n_flights):
+        folder = os.path.join(str(root), f"flight{k:03d}")
+        os.makedirs(folder, exist_ok=True)
+        length = min(flight_duration, duration - k * flight_duration)
+        t0 = pd.Timestamp(start) + pd.Timedelta(seconds=k * (flight_duration + 600))
+        n = 2 * length
+        for part in range(2):
+            t = t0 + pd.to_timedelta(
+                np.arange(part * n // 2, (part + 1) * n // 2) * 0.5, unit="s"
+            )
+            m = len(t)
+            pd.DataFrame(
+                {
+                    "date": t.strftime("%Y-%m-%d"),
+                    "time": t.strftime("%H:%M:%S.%f"),
+                    "temp": rng.normal(10, 1, m),
+                    "press": rng.normal(1000, 5, m),
+                    "rh": rng.uniform(0, 100, m),
+                }
+            ).to_csv(os.path.join(folder, f"bme_{part}.csv"), index=False)
+            t2 = t + pd.Timedelta(seconds=0.3)
+            pd.DataFrame(
+                {
+                    "datetime": t2.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    "bin 0": rng.integers(0, 100, m),
+                    "bin 1": rng.integers(0, 100, m),
+                    "flow": rng.normal(5, 0.1, m),
+                }
+            ).to_csv(os.path.join(folder, f"opc-{part}.txt"), index=False, sep=";")
+        t3 = t0 + pd.to_timedelta(np.arange(length // 2) * 2, unit="s")
+        pd.DataFrame(
+            {
+                "date": t3.strftime("%Y-%m-%d %H:%M:%S"),
+                "lat": rng.normal(60, 0.01, len(t3)),
+                "lon": rng.normal(25, 0.01, len(t3)),
+            }
+        ).to_csv(os.path.join(folder, "gps.csv"), index=False)
+
+
+def wind_dir(
+    root: str | PathLike[str],
+    duration: int,
+    seed: int = 0,
+    flight_duration: int = 1800,
+    start: pd.Timestamp = START,
+) -> None:
+    """
+    DJI flight records for merge_wind_data at 10 Hz, one file per flight
+    root: output directory
+    """
+    os.makedirs(root, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_flights = max(1, -(-duration // flight_duration))
+    for k in range(n_flights):
+        length = min(flight_duration, duration - k * flight_duration)
+        t0 = pd.Timestamp(start) + pd.Timedelta(seconds=k * (flight_duration + 600))
+        n = 10 * length
+        ms = np.arange(n) * 100
+        flight_time = [
+            f"{x // 3600000:02d}:{x // 60000 % 60:02d}:"
+            f"{x // 1000 % 60:02d}.{x % 1000:03d}"
+            for x in ms.tolist()
+        ]
+        pd.DataFrame(
+            {
+                "Flight time": flight_time,
+                "Wind speed": rng.uniform(0, 10, n).round(2),
+                "Wind direction": rng.uniform(0, 360, n).round(1),
+            }
+        ).to_csv(
+            os.path.join(
+                str(root),
+                f"DJIFlightRecord_{t0.strftime('%Y-%m-%d_%H-%M-%S')}.csv",
+            ),
+            index=False,
+        )
+
+
+def generate(root: str | PathLike[str], duration: int, seed: int = 0) -> dict[str, str]:
+    """
+    All synthetic inputs of one scale, skipped when already generated
+    root: output directory
+    duration: logged seconds
+    seed: random seed
+    return: dict of input name and path
+    """
+    root = os.path.join(str(root), f"{duration}s_seed{seed}")
+    paths = {
+        "cpc": os.path.join(root, "cpc.csv"),
+        "bme": os.path.join(root, "bme.csv"),
+        "pops": os.path.join(root, "pops.csv"),
+        "mcda": os.path.join(root, "mcda.csv"),
+        "sensor_tree": os.path.join(root, "sensor_tree"),
+        "wind": os.path.join(root, "wind"),
+    }
+    done = os.path.join(root, "done")
+    if os.path.exists(done):
+        return paths
+    os.makedirs(root, exist_ok=True)
+    cpc(paths["cpc"], duration, seed)
+    bme(paths["bme"], duration, seed)
+    pops(paths["pops"], duration, seed)
+    mcda(paths["mcda"], duration, seed)
+    sensor_tree(paths["sensor_tree"], duration, seed)
+    wind_dir(paths["wind"], duration, seed)
+    open(done, "w").close()
+    return paths
@@ -0,0 +1,181 @@
+import importlib.resources
+import json
+from dataclasses import dataclass, field
+from functools import cache, lru_cache
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from UAVision.utils import calculate_binedges, calculate_midbin
+
+# bundled bin edge resources of the instruments with fixed bins
+_BINEDGES_FILES = {
+    "opcn2": "opcN2_binedges.txt",
+    "opcn3": "opcN3_binedges.txt",
+    "pops": "pops_binedges.txt",
+}
+
+
+def _read_only(arr: NDArray[np.float64]) -> NDArray[np.float64]:
+    arr.setflags(write=False)
+    return arr
+
+
+@cache
+def _mcda_midbin_all() -> dict[str, list[float]]:
+    return json.loads(
+        importlib.resources.files("UAVision.bin_edges")
+        .joinpath("mcda_midbin_all.txt")
+        .read_text()
+    )
+
+
+def load_mcda_midbin_all() -> dict[str, list[float]]:
+    """
+    Bundled mcda mid-bin values for each size setting, read on first use
+    return: dict of size key and list of 256 mid-bin values (um), a copy
+            the caller may modify
+    """
+    return {k: list(v) for k, v in _mcda_midbin_all().items()}
+
+
+@cache
+def load_binedges(instrument: str) -> NDArray[np.float64]:
+    """
+    Bundled bin edges of an instrument, read on first use
+    instrument: 'opcn2', 'opcn3' or 'pops'
+    return: read-only bin edges array (um)
+    """
+    text = (
+        importlib.resources.files("UAVision.bin_edges")
+        .joinpath(_BINEDGES_FILES[instrument])
+        .read_text()
+    )
+    return _read_only(np.array(text.split(), dtype=float))
+
+
+@dataclass(frozen=True, eq=False)
+class BinGeometry:
+    """
+    Read-only bin geometry of a size distribution instrument
+
+    edges: bin edges (um)
+    midbin: mid-bin diameters (um)
+    dlog_bin: dlogDp of each bin
+    d2: midbin**2
+    d3: midbin**3
+    """
+
+    edges: NDArray[np.float64]
+    midbin: NDArray[np.float64]
+    dlog_bin: NDArray[np.float64]
+    d2: NDArray[np.float64]
+    d3: NDArray[np.float64]
+    _thresholds: dict[tuple[float, int], int] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_edges(cls, edges: NDArray[np.float64]) -> "BinGeometry":
+        edges = np.array(edges, dtype=float)
+        return cls._build(edges, calculate_midbin(edges))
+
+    @classmethod
+    def from_midbin(cls, midbin: NDArray[np.float64]) -> "BinGeometry":
+        midbin = np.array(midbin, dtype=float)
+        return cls._build(calculate_binedges(midbin), midbin)
+
+    @classmethod
+    def _build(
+        cls, edges: NDArray[np.float64], midbin: NDArray[np.float64]
+    ) -> "BinGeometry":
+        dlog_bin = np.log10(edges[1:]) - np.log10(edges[:-1])
+        return cls(
+            edges=_read_only(edges),
+            midbin=_read_only(midbin),
+            dlog_bin=_read_only(dlog_bin),
+            d2=_read_only(midbin**2),
+            d3=_read_only(midbin**3),
+        )
+
+    def threshold_index(self, diameter: float, start: int = 0) -> int:
+        """
+        Index of the first bin larger than diameter, counted from start
+        diameter: threshold diameter (um)
+        start: first bin considered
+        return: index into midbin[start:]
+        """
+        key = (diameter, start)
+        if key not in self._thresholds:
+            self._thresholds[key] = int(np.argmax(self.midbin[start:] > diameter))
+        return self._thresholds[key]
+
+
+@cache
+def _bundled_geometry(instrument: str, size: str | None) -> BinGeometry:
+    if instrument == "mcda":
+        assert size is not None
+        return BinGeometry.from_midbin(np.array(_mcda_midbin_all()[size]))
+    return BinGeometry.from_edges(load_binedges(instrument))
+
+
+# user supplied bins, keyed by their float64 bytes, the least recently used
+# geometries are dropped so a stream of different bins does not grow memory
+@lru_cache(maxsize=64)
+def _custom_geometry(instrument: str, values: bytes) -> BinGeometry:
+    arr = np.frombuffer(values, dtype=np.float64).copy()
+    if instrument == "mcda":
+        return BinGeometry.from_midbin(arr)
+    return BinGeometry.from_edges(arr)
+
+
+def get_bin_geometry(
+    instrument: str,
+    size: str | Sequence[float] | NDArray[np.float64] | None = None,
+) -> BinGeometry:
+    """
+    Memoized bin geometry of an instrument
+    instrument: 'mcda', 'pops', 'opcn2' or 'opcn3'
+    size: mcda: size key string, one of
+            ['PSL_0.6-40', 'PSL_0.15-17', 'water_0.6-40', 'water_0.15-17'] OR
+            an array-like of 256 mid-bin values
+          pops: None for the bundled bin edges OR an array-like of 17 bin edges
+          opcn2, opcn3: None for the bundled bin edges
+    return: BinGeometry, shared between calls with the same arguments
+    """
+    if instrument == "mcda":
+        if isinstance(size, (list, tuple, np.ndarray, pd.Series)):
+            mid_bin = np.asarray(size, dtype=float)
+            if mid_bin.ndim != 1 or mid_bin.size != 256:
+                raise ValueError(
+                    "When providing an array-like 'size', it must be one-dimensional with length 256."
+                )
+            return _custom_geometry(instrument, mid_bin.tobytes())
+        elif isinstance(size, str):
+            mcda_midbin_all = _mcda_midbin_all()
+            if size not in mcda_midbin_all:
+                raise KeyError(
+                    f"size '{size}' not found. Valid keys: {list(mcda_midbin_all.keys())}"
+                )
+            return _bundled_geometry(instrument, size)
+        raise TypeError(
+            "size must be a key string or an array-like of 256 mid-bin values"
+        )
+
+    if instrument not in _BINEDGES_FILES:
+        raise ValueError(
+            f"instrument must be one of {['mcda', *_BINEDGES_FILES]}, got {instrument!r}"
+        )
+    if size is None:
+        return _bundled_geometry(instrument, None)
+    if isinstance(size, (list, tuple, np.ndarray, pd.Series)):
+        n_edges = load_binedges(instrument).size
+        edges = np.asarray(size, dtype=float)
+        if edges.ndim != 1 or edges.size != n_edges:
+            raise ValueError(
+                f"When providing 'size' as an array it must be a 1-D array of {n_edges} bin edges."
+            )
+        return _custom_geometry(instrument, edges.tobytes())
+    raise TypeError(
+        f"size must be None or an array-like of {load_binedges(instrument).size} bin edges"
+    )
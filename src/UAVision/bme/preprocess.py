@@ -2,6 +2,10 @@ import pandas as pd
 import numpy as np
 from numpy.typing import NDArray
 from os import PathLike
+from typing import Iterator
+
+from UAVision.profiling import iter_stage, stage
+from UAVision.utils import compact_dtypes, combine_date_time, guess_date_format
 
 
 def calculate_height(
@@ -24,10 +28,72 @@ def calculate_height(
     return height
 
 
+class HeightIntegrator:
+    """
+    Incremental height integration based on hydrostatic pressure equation,
+    carrying the last valid pressure, temperature and cumulative height
+    across chunks, so height can be computed on data as it arrives
+
+    p_last: last valid pressure (hPa), None before the first valid sample
+    T_last: temperature at p_last (C)
+    height: cumulative height of the last sample (meters)
+    """
+
+    def __init__(self) -> None:
+        self.p_last: float | None = None
+        self.T_last: float | None = None
+        self.height: float = 0.0
+
+    def update(
+        self,
+        p: NDArray[np.float64],
+        T: NDArray[np.float64],
+    ) -> NDArray[np.float64]:
+        """
+        Advance integration by a chunk of samples
+        p: pressure of the chunk (hPa)
+        T: temperature of the chunk (C)
+        return: cumulative height of each sample (meters), samples with
+                missing pressure or temperature do not add height
+        """
+        p = np.asarray(p, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        valid = ~np.isnan(p)
+        p_valid = p[valid]
+        T_valid = T[valid]
+
+        thickness = np.zeros(p_valid.size, dtype=np.float64)
+        if p_valid.size:
+            # p_last and T_last are set together
+            if self.p_last is None or self.T_last is None:
+                thickness[1:] = calculate_height(
+                    p_valid[:-1], p_valid[1:], T_valid[:-1], T_valid[1:]
+                )
+            else:
+                thickness[:] = calculate_height(
+                    np.concatenate(([self.p_last], p_valid[:-1])),
+                    p_valid,
+                    np.concatenate(([self.T_last], T_valid[:-1])),
+                    T_valid,
+                )
+            self.p_last = float(p_valid[-1])
+            self.T_last = float(T_valid[-1])
+
+        dh = np.zeros(p.size, dtype=np.float64)
+        dh[valid] = thickness
+        dh[np.isnan(dh)] = 0
+        # carried height is prepended so the sums match a single global cumsum
+        height = np.cumsum(np.concatenate(([self.height], dh)))[1:]
+        if height.size:
+            self.height = float(height[-1])
+        return height
+
+
 def calculate_height_df(
     df: pd.DataFrame,
     p: str,
     T: str,
+    integrator: HeightIntegrator | None = None,
 ) -> pd.DataFrame:
     """
     Advance calculation of height based on hydrostatic pressure equation,
@@ -35,36 +101,27 @@ def calculate_height_df(
     df: dataframe containing pressure and temperature columns
     p: pressure column name (string) (hPa)
     T: temperature column name (string) (C)
+    integrator: optional HeightIntegrator carrying state from previous chunks,
+                None starts from zero height
     return: dataframe with height column added (meters)
     """
-    df_height = df.copy()
-    df_height.dropna(subset=p, inplace=True)
-    height = np.zeros_like(df_height[p], dtype=np.float64)
-    height[1:] = calculate_height(
-        df_height[p][:-1].to_numpy(dtype=np.float64),
-        df_height[p][1:].to_numpy(dtype=np.float64),
-        df_height[T][:-1].to_numpy(dtype=np.float64),
-        df_height[T][1:].to_numpy(dtype=np.float64),
+    if integrator is None:
+        integrator = HeightIntegrator()
+    df["height"] = integrator.update(
+        df[p].to_numpy(dtype=np.float64), df[T].to_numpy(dtype=np.float64)
     )
-    df_height["height"] = height
-    df["height"] = df_height["height"]
-    df.replace({"height": np.nan}, 0, inplace=True)
-    df["height"] = df["height"].cumsum()
     return df
 
 
-def preprocess_bme(file: str | PathLike[str]) -> pd.DataFrame:
-    """
-    BME processing
-    file: path to bme csv file (string or PathLike)
-    return: processed dataframe
-    """
-    df = pd.read_csv(file)
+def _process_bme_frame(
+    df: pd.DataFrame,
+    integrator: HeightIntegrator,
+    date_format: str | None = None,
+) -> pd.DataFrame:
     df = df.dropna(axis=0)
     df = df.reset_index(drop=True)
-    df["datetime"] = pd.to_datetime(
-        df["date"].astype(str) + " " + df["time"].astype(str)
-    )
+    with stage("bme.datetime", len(df)):
+        df["datetime"] = combine_date_time(df["date"], df["time"], date_format)
     df = df.drop(["date", "time"], axis=1)
     time_col = df.pop("datetime")
     df.insert(0, "datetime", time_col)
@@ -76,6 +133,54 @@ def preprocess_bme(file: str | PathLike[str]) -> pd.DataFrame:
         },
         axis=1,
     )
-    df = calculate_height_df(df, "press_bme (hPa)", "temp_bme (C)")
+    with stage("bme.height", len(df)):
+        df = calculate_height_df(df, "press_bme (hPa)", "temp_bme (C)", integrator)
     df = df.rename({"height": "height_bme (m)"}, axis=1)
     return df
+
+
+def preprocess_bme(file: str | PathLike[str], compact: bool = False) -> pd.DataFrame:
+    """
+    BME processing
+    file: path to bme csv file (string or PathLike)
+    compact: bool, if True store float columns as float32 and integer columns
+             as the smallest integer type, see UAVision.utils.compact_dtypes.
+             Height is integrated in float64 before (default False)
+    return: processed dataframe
+    """
+    with stage("bme.preprocess_bme") as total:
+        with stage("bme.read_csv") as s:
+            df = pd.read_csv(file)
+            s.rows = len(df)
+        df = _process_bme_frame(df, HeightIntegrator())
+        if compact:
+            df = compact_dtypes(df)
+        total.rows = len(df)
+    return df
+
+
+def iter_preprocess_bme(
+    file: str | PathLike[str],
+    chunksize: int = 10000,
+) -> Iterator[pd.DataFrame]:
+    """
+    BME processing in blocks of rows, height is carried across blocks
+    file: path to bme csv file (string or PathLike)
+    chunksize: number of raw rows per block (int)
+    return: iterator of processed dataframe blocks, their concatenation
+            equals the output of preprocess_bme
+    """
+    integrator = HeightIntegrator()
+    date_format = None
+    start = 0
+    with pd.read_csv(file, chunksize=chunksize) as reader:
+        for chunk in iter_stage(reader, "bme.read_csv"):
+            chunk = chunk.dropna(axis=0)
+            if chunk.empty:
+                continue
+            if date_format is None:
+                date_format = guess_date_format(chunk["date"], chunk["time"])
+            df = _process_bme_frame(chunk, integrator, date_format)
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
@@ -0,0 +1,297 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import uuid
+from os import PathLike
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from UAVision import __version__
+from UAVision.columnar import load_columnar, save_columnar
+from UAVision.profiling import stage
+from UAVision.utils import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# entries are '<key>.npy' directories written by save_columnar, file hashes
+# are remembered in 'hashes/', one file per input path holding its size,
+# mtime and hash
+_ENTRY_SUFFIX = ".npy"
+_HASHES = "hashes"
+
+
+def default_cache_dir() -> Path:
+    """
+    return: $XDG_CACHE_HOME/UAVision, default ~/.cache/UAVision
+    """
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return Path(root).expanduser() / "UAVision"
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return {"ndarray": value.tolist(), "dtype": str(value.dtype)}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, PathLike):
+        return os.fspath(value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"argument of type {type(value).__name__} can not be cached")
+
+
+def _directory_size(path: Path) -> int:
+    return sum(x.stat().st_size for x in path.iterdir())
+
+
+def _remove(path: Path) -> None:
+    # moved aside first, so that readers never see a partly deleted entry
+    trash = path.with_name(f".{path.name}.{uuid.uuid4().hex}.del")
+    try:
+        os.rename(path, trash)
+    except OSError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+class ResultCache:
+    """
+    On-disk cache of preprocess_* results, keyed by the sha256 of the input
+    file content, the function, its arguments and the package version.
+    Results are stored as directories of .npy files (see save_columnar) and
+    the least recently used are removed when the cache exceeds max_bytes.
+    Entries are written to a temporary name and renamed, so several processes
+    can share one cache directory. The size is tracked per ResultCache after
+    one scan of the directory, entries added by other processes are counted
+    at the next eviction.
+
+    directory: cache directory (string or PathLike), default
+               default_cache_dir()
+    max_bytes: size bound of the stored results in bytes (default 2 GB)
+
+    Usage:
+        cache = ResultCache()
+        df = cache.call(preprocess_mcda, "data_path/mcda.csv", "water_0.6-40")
+        df = cache.call(preprocess_pops, "data_path/pops.csv", drop_aux=False)
+    """
+
+    def __init__(
+        self,
+        directory: str | PathLike[str] | None = None,
+        max_bytes: int = 2_000_000_000,
+    ) -> None:
+        self.directory = default_cache_dir() if directory is None else Path(directory)
+        self.max_bytes = max_bytes
+        # bytes of the stored entries, None until the directory is scanned
+        self._size: int | None = None
+        (self.directory / _HASHES).mkdir(parents=True, exist_ok=True)
+
+    def file_hash(self, file: str | PathLike[str]) -> str:
+        """
+        sha256 of a file, computed again only when its size or mtime changed
+        file: file path (string or PathLike)
+        return: hex digest
+        """
+        path = os.path.abspath(file)
+        st = os.stat(path)
+        state = f"{st.st_size} {st.st_mtime_ns}"
+        memo = self.directory / _HASHES / hashlib.sha256(path.encode()).hexdigest()
+        try:
+            saved, digest = memo.read_text().split("\n")
+            if saved == state:
+                # the mtime of a memo is its last use, see evict
+                os.utime(memo)
+                return digest
+        except (FileNotFoundError, ValueError):
+            pass
+        digest = file_sha256(path)
+        tmp = memo.with_name(f".{memo.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(f"{state}\n{digest}")
+        os.replace(tmp, memo)
+        return digest
+
+    def key(
+        self,
+        function: Callable[..., Any],
+        file: str | PathLike[str],
+        *args: Any,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Cache key of a call, the arguments are bound to the signature of the
+        function so that defaults and keyword or positional use give the same key
+        function: preprocess function taking the input file first
+        file: input file (string or PathLike)
+        args, kwargs: further arguments of the function
+        return: hex digest
+        """
+        bound = inspect.signature(function).bind(file, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop(next(iter(arguments)))
+        record = {
+            "function": f"{function.__module__}.{function.__qualname__}",
+            "version": __version__,
+            "file": self.file_hash(file),
+            "arguments": _jsonable(arguments),
+        }
+        return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / (key + _ENTRY_SUFFIX)
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        """
+        key: cache key, see key
+        return: the cached dataframe, or None if it is not cached
+        """
+        entry = self._entry(key)
+        try:
+            df = load_columnar(entry, mmap=False)
+            os.utime(entry)
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            # missing, or removed by another process while reading
+            return None
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> bool:
+        """
+        Store a dataframe and evict least recently used entries when the
+        cache exceeds max_bytes
+        key: cache key, see key
+        df: dataframe with a default index and numeric or datetime columns
+        return: True if stored, False if the dataframe can not be stored exactly
+                or is larger than max_bytes
+        """
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0:
+            return False
+        if any(x == object or isinstance(x, pd.StringDtype) for x in df.dtypes):
+            return False
+        if not all(isinstance(x, str) for x in df.columns) or df.columns.has_duplicates:
+            return False
+        if df.memory_usage(index=False).sum() > self.max_bytes:
+            return False
+        entry = self._entry(key)
+        tmp = entry.with_name(f".{entry.name}.{uuid.uuid4().hex}.tmp")
+        save_columnar(df, tmp, "npy")
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # written by another process in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+            return True
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += _directory_size(entry)
+        if self._size > self.max_bytes:
+            self.evict()
+        return True
+
+    def entries(self) -> pd.DataFrame:
+        """
+        return: dataframe of the stored entries with key, bytes and last_used,
+                least recently used first
+        """
+        rows = []
+        for path in self.directory.glob("*" + _ENTRY_SUFFIX):
+            try:
+                rows.append(
+                    {
+                        "key": path.name[: -len(_ENTRY_SUFFIX)],
+                        "bytes": _directory_size(path),
+                        "last_used": path.stat().st_mtime_ns,
+                    }
+                )
+            except FileNotFoundError:
+                continue
+        table = pd.DataFrame(rows, columns=["key", "bytes", "last_used"])
+        table["last_used"] = pd.to_datetime(table["last_used"], unit="ns")
+        return table.sort_values("last_used", kind="stable").reset_index(drop=True)
+
+    def size(self) -> int:
+        """
+        return: bytes of the stored entries
+        """
+        return int(self.entries()["bytes"].sum())
+
+    def evict(self, max_bytes: int | None = None) -> int:
+        """
+        Remove least recently used entries until the cache fits in max_bytes,
+        and the remembered hashes of files not used since the last removed
+        entry was used
+        max_bytes: optional bound, default the bound of the cache
+        return: number of removed entries
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        table = self.entries()
+        size = int(table["bytes"].sum())
+        n = 0
+        for key, entry_bytes in zip(table["key"], table["bytes"]):
+            if size <= max_bytes:
+                break
+            _remove(self._entry(key))
+            size -= entry_bytes
+            n += 1
+        self._size = size
+        if n:
+            cutoff = table["last_used"].iloc[n - 1].value
+            for memo in (self.directory / _HASHES).iterdir():
+                try:
+                    if memo.stat().st_mtime_ns <= cutoff:
+                        memo.unlink()
+                except FileNotFoundError:
+                    continue
+        return n
+
+    def clear(self) -> None:
+        """
+        Remove all entries and remembered file hashes
+        return: None
+        """
+        self.evict(0)
+        self._size = 0
+        shutil.rmtree(self.directory / _HASHES, ignore_errors=True)
+        (self.directory / _HASHES).mkdir(parents=True, exist_ok=True)
+
+    def call(
+        self,
+        function: Callable[..., pd.DataFrame],
+        file: str | PathLike[str],
+        *args: Any,
+        **kwargs: Any,
+    ) -> pd.DataFrame:
+        """
+        Result of function(file, *args, **kwargs), from the cache if the same
+        call was cached before on the same file content
+        function: preprocess function taking the input file first, e.g.
+                  preprocess_cpc, preprocess_bme, preprocess_pops or
+                  preprocess_mcda
+        file: input file (string or PathLike)
+        args, kwargs: further arguments of the function, e.g. size or drop_aux
+        return: dataframe, equal to the uncached result
+        """
+        with stage("cache.key"):
+            key = self.key(function, file, *args, **kwargs)
+        with stage("cache.get") as s:
+            df = self.get(key)
+            s.rows = None if df is None else len(df)
+        if df is not None:
+            logger.debug("cache hit %s %s", function.__qualname__, file)
+            return df
+        df = function(file, *args, **kwargs)
+        with stage("cache.put", len(df)):
+            if not self.put(key, df):
+                logger.debug("result of %s not cached", function.__qualname__)
+        return df
@@ -0,0 +1,371 @@
+import glob
+import json
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from UAVision import __version__
+from UAVision.cache import ResultCache
+from UAVision.columnar import load_columnar
+
+# instruments with a reader; 'merged' are the outputs of merge_sensor_data
+INSTRUMENTS = ["cpc", "bme", "pops", "mcda", "merged"]
+
+TimeLike = str | pd.Timestamp
+
+
+def _call(
+    function: Callable[..., pd.DataFrame],
+    path: str,
+    options: dict[str, Any],
+    cache: ResultCache | None,
+) -> pd.DataFrame:
+    if cache is None:
+        return function(path, **options)
+    return cache.call(function, path, **options)
+
+
+def _read_cpc(
+    path: str, options: dict[str, Any], cache: ResultCache | None = None
+) -> pd.DataFrame:
+    from UAVision.cpc.preprocess import preprocess_cpc
+
+    return _call(preprocess_cpc, path, {}, cache)
+
+
+def _read_bme(
+    path: str, options: dict[str, Any], cache: ResultCache | None = None
+) -> pd.DataFrame:
+    from UAVision.bme.preprocess import preprocess_bme
+
+    return _call(preprocess_bme, path, {}, cache)
+
+
+def _read_pops(
+    path: str, options: dict[str, Any], cache: ResultCache | None = None
+) -> pd.DataFrame:
+    from UAVision.pops.preprocess import preprocess_pops
+
+    return _call(preprocess_pops, path, options, cache)
+
+
+def _read_mcda(
+    path: str, options: dict[str, Any], cache: ResultCache | None = None
+) -> pd.DataFrame:
+    from UAVision.mcda.preprocess import preprocess_mcda
+
+    return _call(preprocess_mcda, path, options, cache)
+
+
+def _read_merged(
+    path: str, options: dict[str, Any], cache: ResultCache | None = None
+) -> pd.DataFrame:
+    if path.endswith(".csv"):
+        df = pd.read_csv(path)
+        df["datetime"] = pd.to_datetime(df["datetime"])
+        return df
+    return load_columnar(path, mmap=False)
+
+
+_READERS: dict[
+    str, Callable[[str, dict[str, Any], ResultCache | None], pd.DataFrame]
+] = {
+    "cpc": _read_cpc,
+    "bme": _read_bme,
+    "pops": _read_pops,
+    "mcda": _read_mcda,
+    "merged": _read_merged,
+}
+
+
+def _file_state(path: str) -> dict[str, int]:
+    # npy outputs are directories, their columns.json is written last
+    if os.path.isdir(path):
+        path = os.path.join(path, "columns.json")
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _unchanged(path: str, entry: dict[str, Any]) -> bool:
+    return all(entry.get(k) == v for k, v in _file_state(path).items())
+
+
+def _in_windows(
+    datetime: pd.Series,
+    windows: list[tuple[pd.Timestamp | None, pd.Timestamp | None]],
+) -> NDArray[np.bool_]:
+    keep = np.zeros(len(datetime), dtype=bool)
+    for t0, t1 in windows:
+        window = np.ones(len(datetime), dtype=bool)
+        if t0 is not None:
+            window &= (datetime >= t0).to_numpy()
+        if t1 is not None:
+            window &= (datetime <= t1).to_numpy()
+        keep |= window
+    return keep
+
+
+def _flight_name(path: str, instrument: str) -> str:
+    if instrument == "merged":
+        return Path(path).name.split("_merged")[0]
+    return Path(path).parent.name
+
+
+class FlightCatalog:
+    """
+    Index of instrument files by flight, instrument and time span, answering
+    time range queries by reading only the files that overlap
+
+    entries: dict of file path and its record: instrument, flight, start and
+             end time (ISO strings), rows, size, mtime and reader options
+    cache: optional ResultCache of the preprocess_* results of raw files.
+           Without it raw instrument files are preprocessed again by every
+           add and query that reads them, only merged outputs are read
+           directly
+
+    Usage:
+        catalog = FlightCatalog(cache=ResultCache())
+        catalog.scan("data_path", "mcda", "*/mcda*.csv", size="water_0.6-40")
+        catalog.scan("data_path", "bme", "*/bme*.csv")
+        catalog.save("data_path/catalog.json")
+        data = catalog.query("2023-05-01 10:00", "2023-05-01 10:30", ["mcda", "bme"])
+    """
+
+    def __init__(
+        self,
+        entries: dict[str, dict[str, Any]] | None = None,
+        cache: ResultCache | None = None,
+    ) -> None:
+        self.entries: dict[str, dict[str, Any]] = {} if entries is None else entries
+        self.cache = cache
+
+    def add(
+        self,
+        file: str | PathLike[str],
+        instrument: str,
+        flight: str | None = None,
+        **options: Any,
+    ) -> dict[str, Any]:
+        """
+        Index one file, reading it once to find its time span
+        file: instrument csv file, or merge_sensor_data output (csv, .parquet,
+              .feather or .npy directory)
+        instrument: 'cpc', 'bme', 'pops', 'mcda' or 'merged'
+        flight: flight name, default the folder name of raw files or the
+                name before '_merged' of merged files
+        options: keyword arguments of the preprocess function, e.g. size for mcda
+        return: the file record
+        """
+        if instrument not in _READERS:
+            raise ValueError(
+                f"instrument must be one of {INSTRUMENTS}, got {instrument!r}"
+            )
+        path = str(file).replace("\\", "/")
+        options = {
+            k: v.tolist() if isinstance(v, np.ndarray) else v
+            for k, v in options.items()
+        }
+        state = _file_state(path)
+        datetime = _READERS[instrument](path, options, self.cache)["datetime"]
+        self.entries[path] = {
+            "instrument": instrument,
+            "flight": _flight_name(path, instrument) if flight is None else flight,
+            "start": None if datetime.empty else datetime.min().isoformat(),
+            "end": None if datetime.empty else datetime.max().isoformat(),
+            "rows": len(datetime),
+            "options": options,
+            **state,
+        }
+        return self.entries[path]
+
+    def scan(
+        self,
+        directory: str | PathLike[str],
+        instrument: str,
+        pattern: str,
+        **options: Any,
+    ) -> int:
+        """
+        Index the files matching a glob pattern, files already indexed and
+        unchanged (size and mtime) are not read again
+        directory: root directory (string or PathLike)
+        instrument: 'cpc', 'bme', 'pops', 'mcda' or 'merged'
+        pattern: glob pattern relative to directory, e.g. '*/bme*.csv' or
+                 '*_merged.parquet'
+        options: keyword arguments of the preprocess function, e.g. size for mcda
+        return: number of files read
+        """
+        n = 0
+        for path in sorted(glob.glob(os.path.join(str(directory), pattern))):
+            path = path.replace("\\", "/")
+            entry = self.entries.get(path)
+            if (
+                entry is not None
+                and entry["instrument"] == instrument
+                and _unchanged(path, entry)
+            ):
+                continue
+            self.add(path, instrument, **options)
+            n += 1
+        return n
+
+    def refresh(self) -> int:
+        """
+        Re-index files changed since they were indexed and drop removed files
+        return: number of files read
+        """
+        n = 0
+        for path, entry in list(self.entries.items()):
+            if not os.path.exists(path):
+                del self.entries[path]
+            elif not _unchanged(path, entry):
+                self.add(path, entry["instrument"], entry["flight"], **entry["options"])
+                n += 1
+        return n
+
+    def save(self, path: str | PathLike[str]) -> None:
+        """
+        Save the index as json, written atomically
+        path: json file (string or PathLike)
+        return: None
+        """
+        path = str(path)
+        with open(path + ".tmp", "w") as fh:
+            json.dump({"version": __version__, "files": self.entries}, fh, indent=1)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(
+        cls, path: str | PathLike[str], cache: ResultCache | None = None
+    ) -> "FlightCatalog":
+        """
+        Load an index saved with save
+        path: json file (string or PathLike)
+        cache: optional ResultCache of the preprocess_* results of raw files
+        return: FlightCatalog
+        """
+        with open(path) as fh:
+            return cls(json.load(fh)["files"], cache)
+
+    def files(
+        self,
+        start: TimeLike | None = None,
+        end: TimeLike | None = None,
+        instruments: Sequence[str] | None = None,
+        flights: Sequence[str] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Indexed files overlapping a time range, without reading them
+        start: optional start of the range (inclusive)
+        end: optional end of the range (inclusive)
+        instruments: optional list of instruments, None for all
+        flights: optional list of flight names, None for all
+        return: dataframe of file records, one row per file, sorted by start
+        """
+        table = pd.DataFrame.from_dict(
+            self.entries,
+            orient="index",
+            columns=["instrument", "flight", "start", "end", "rows"],
+        )
+        table.index.name = "file"
+        table["start"] = pd.to_datetime(table["start"])
+        table["end"] = pd.to_datetime(table["end"])
+        keep = table["rows"] > 0
+        if start is not None:
+            keep &= table["end"] >= pd.Timestamp(start)
+        if end is not None:
+            keep &= table["start"] <= pd.Timestamp(end)
+        if instruments is not None:
+            keep &= table["instrument"].isin(instruments)
+        if flights is not None:
+            keep &= table["flight"].isin(flights)
+        return table[keep].sort_values("start")
+
+    def _read(
+        self,
+        path: str,
+        windows: list[tuple[pd.Timestamp | None, pd.Timestamp | None]],
+    ) -> pd.DataFrame:
+        entry = self.entries[path]
+        if entry["instrument"] == "merged" and os.path.isdir(path):
+            # rows of the sorted npy datetime column are found by bisection
+            df = load_columnar(path, mmap=True)
+            datetime = df["datetime"].to_numpy()
+            rows = [
+                np.arange(
+                    0 if t0 is None else np.searchsorted(datetime, t0.to_datetime64()),
+                    len(df)
+                    if t1 is None
+                    else np.searchsorted(datetime, t1.to_datetime64(), side="right"),
+                )
+                for t0, t1 in windows
+            ]
+            return df.iloc[np.unique(np.concatenate(rows))].copy()
+        if entry["instrument"] == "merged" and path.endswith(".parquet"):
+            # row groups outside the windows are skipped using their statistics
+            filters = []
+            for t0, t1 in windows:
+                window = []
+                if t0 is not None:
+                    window.append(("datetime", ">=", t0))
+                if t1 is not None:
+                    window.append(("datetime", "<=", t1))
+                if not window:
+                    # an unbounded window keeps every row
+                    return pd.read_parquet(path)
+                filters.append(window)
+            return pd.read_parquet(path, filters=filters)
+        df = _READERS[entry["instrument"]](path, entry["options"], self.cache)
+        return df[_in_windows(df["datetime"], windows)]
+
+    def query(
+        self,
+        start: TimeLike | None = None,
+        end: TimeLike | None = None,
+        instruments: Sequence[str] | None = None,
+        flights: Sequence[str] | None = None,
+        windows: Sequence[tuple[TimeLike | None, TimeLike | None]] | None = None,
+    ) -> dict[str, pd.DataFrame]:
+        """
+        Data of a time range, only files overlapping the range are read,
+        each at most once. Raw instrument files are preprocessed in full by
+        every query, unless the catalog has a cache
+        start: optional start of the range (inclusive)
+        end: optional end of the range (inclusive)
+        instruments: optional list of instruments, None for all
+        flights: optional list of flight names, None for all
+        windows: optional list of (start, end) ranges used instead of start
+                 and end, e.g. the same half hour on several days
+        return: dict of instrument and its processed rows in the range(s),
+                sorted by datetime
+        """
+        if windows is None:
+            windows = [(start, end)]
+        ranges = [
+            (
+                None if t0 is None else pd.Timestamp(t0),
+                None if t1 is None else pd.Timestamp(t1),
+            )
+            for t0, t1 in windows
+        ]
+        overlapping: dict[str, list] = {}
+        for t0, t1 in ranges:
+            for path in self.files(t0, t1, instruments, flights).index:
+                overlapping.setdefault(str(path), []).append((t0, t1))
+
+        blocks: dict[str, list[pd.DataFrame]] = {}
+        for path, file_windows in overlapping.items():
+            blocks.setdefault(self.entries[path]["instrument"], []).append(
+                self._read(path, file_windows)
+            )
+        return {
+            x: pd.concat(dfs, ignore_index=True)
+            .sort_values("datetime", kind="stable")
+            .reset_index(drop=True)
+            for x, dfs in blocks.items()
+        }
@@ -0,0 +1,138 @@
+import importlib.util
+import json
+from os import PathLike
+from pathlib import Path
+from typing import Literal, Sequence
+
+import numpy as np
+import pandas as pd
+
+ColumnarFormat = Literal["parquet", "feather", "npy"]
+
+_SUFFIXES: dict[str, ColumnarFormat] = {
+    ".parquet": "parquet",
+    ".feather": "feather",
+}
+_NPY_META = "columns.json"
+
+
+def has_pyarrow() -> bool:
+    """
+    Check if pyarrow is installed, needed for parquet and feather
+    return: bool
+    """
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _resolve_format(path: Path, format: ColumnarFormat | None) -> ColumnarFormat:
+    if format is not None:
+        return format
+    if path.suffix in _SUFFIXES:
+        return _SUFFIXES[path.suffix]
+    return "parquet" if has_pyarrow() and path.suffix != ".npy" else "npy"
+
+
+def columnar_path(
+    path: str | PathLike[str], format: ColumnarFormat | None = None
+) -> Path:
+    """
+    Path of a columnar file with the suffix matching the format
+    path: path without or with suffix (string or PathLike)
+    format: 'parquet', 'feather' or 'npy' (directory of .npy files),
+            default parquet when pyarrow is installed, else npy
+    return: Path
+    """
+    path = Path(path)
+    # only a known suffix is replaced, names may contain dots (2023.05.01_merged)
+    if path.suffix in (".parquet", ".feather", ".npy", ".csv"):
+        path = path.with_suffix("")
+    if format is None:
+        format = "parquet" if has_pyarrow() else "npy"
+    return path.with_name(f"{path.name}.{format}")
+
+
+def save_columnar(
+    df: pd.DataFrame,
+    path: str | PathLike[str],
+    format: ColumnarFormat | None = None,
+) -> Path:
+    """
+    Save a processed dataframe in a columnar binary format
+    df: dataframe, e.g. output of preprocess_mcda (index is not stored)
+    path: output path, '.parquet' / '.feather' file or '.npy' directory
+    format: 'parquet', 'feather' or 'npy', inferred from the suffix if None,
+            parquet and feather require pyarrow
+    return: path written
+    """
+    path = Path(path)
+    format = _resolve_format(path, format)
+    df = df.reset_index(drop=True)
+    if format == "parquet":
+        df.to_parquet(path, index=False)
+    elif format == "feather":
+        df.to_feather(path)
+    elif format == "npy":
+        # one .npy file per column, so columns can be memory-mapped separately
+        path.mkdir(parents=True, exist_ok=True)
+        names = [str(x) for x in df.columns]
+        objects = []
+        for i, name in enumerate(names):
+            values = df[name].to_numpy()
+            if values.dtype == object:
+                # stored as strings with a mask of the missing values
+                missing = pd.isna(values)
+                values = np.where(missing, "", values).astype(str)
+                np.save(path / f"{i}.na.npy", missing, allow_pickle=False)
+                objects.append(i)
+            np.save(path / f"{i}.npy", values, allow_pickle=False)
+        (path / _NPY_META).write_text(
+            json.dumps({"columns": names, "objects": objects})
+        )
+    else:
+        raise ValueError(f"format must be 'parquet', 'feather' or 'npy', got {format}")
+    return path
+
+
+def load_columnar(
+    path: str | PathLike[str],
+    columns: Sequence[str] | None = None,
+    mmap: bool = True,
+) -> pd.DataFrame:
+    """
+    Load a dataframe saved with save_columnar
+    path: '.parquet' / '.feather' file or '.npy' directory
+    columns: optional list of column names to read, None reads all
+    mmap: bool, memory-map the .npy columns instead of reading them (default True)
+    return: dataframe
+    """
+    path = Path(path)
+    if path.is_dir():
+        meta = json.loads((path / _NPY_META).read_text())
+        names: list[str] = meta["columns"]
+        objects = set(meta.get("objects", []))
+        if columns is None:
+            columns = names
+        missing = [x for x in columns if x not in names]
+        if missing:
+            raise KeyError(f"columns not found: {missing}")
+        position = {x: i for i, x in enumerate(names)}
+        data = {}
+        for x in columns:
+            i = position[x]
+            if i in objects:
+                values = np.load(path / f"{i}.npy", allow_pickle=False).astype(object)
+                values[np.load(path / f"{i}.na.npy", allow_pickle=False)] = np.nan
+                data[x] = values
+            else:
+                data[x] = np.load(
+                    path / f"{i}.npy",
+                    mmap_mode="r" if mmap else None,
+                    allow_pickle=False,
+                )
+        return pd.DataFrame(data, columns=list(columns), copy=False)
+    format = _resolve_format(path, None)
+    if format == "parquet":
+        return pd.read_parquet(path, columns=None if columns is None else list(columns))
+    elif format == "feather":
+        return pd.read_feather(path, columns=None if columns is None else list(columns))
+    raise ValueError(f"unknown columnar file: {path}")
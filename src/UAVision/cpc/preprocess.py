@@ -2,17 +2,35 @@ import pandas as pd
 import numpy as np
 from os import PathLike
 
+from UAVision.profiling import stage
+from UAVision.utils import compact_dtypes, parse_datetime
 
-def preprocess_cpc(file: str | PathLike[str]) -> pd.DataFrame:
+
+def preprocess_cpc(file: str | PathLike[str], compact: bool = False) -> pd.DataFrame:
     """
     CPC processing
     file: path to cpc csv file (string or PathLike)
+    compact: bool, if True store float columns as float32 and integer columns
+             as the smallest integer type after processing in float64, see
+             UAVision.utils.compact_dtypes (default False)
     return: processed dataframe
     """
-    df = pd.read_csv(file)
+    with stage("cpc.preprocess_cpc") as total:
+        with stage("cpc.read_csv") as s:
+            df = pd.read_csv(file)
+            s.rows = len(df)
+        df = _process_cpc_frame(df)
+        if compact:
+            df = compact_dtypes(df)
+        total.rows = len(df)
+    return df
+
+
+def _process_cpc_frame(df: pd.DataFrame) -> pd.DataFrame:
     df = df.dropna(axis=0)
     df = df.reset_index(drop=True)
-    df["datetime"] = pd.to_datetime(df["date_time"])
+    with stage("cpc.datetime", len(df)):
+        df["datetime"] = parse_datetime(df["date_time"])
     df.replace(0, np.nan, inplace=True)  # 0 values are invalid
     df = df.drop(["date_time"], axis=1)
     time_col = df.pop("datetime")
@@ -0,0 +1,360 @@
+import abc
+import io
+import os
+import threading
+import time
+from os import PathLike
+from typing import Callable, Iterator, Literal, Self, Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from UAVision.bins import get_bin_geometry
+from UAVision.bme.preprocess import HeightIntegrator, _process_bme_frame
+from UAVision.cpc.preprocess import _process_cpc_frame
+from UAVision.mcda.preprocess import _process_mcda_frame
+from UAVision.pops.preprocess import _process_pops_frame
+from UAVision.utils import guess_date_format
+
+Instrument = Literal["cpc", "bme", "pops", "mcda"]
+
+
+# bytes at the start of the file compared to detect a rewritten file
+_HEAD_BYTES = 256
+
+
+class _LineTail:
+    """
+    Read complete lines appended to a growing file since the last call
+    """
+
+    def __init__(self, file: str | PathLike[str]) -> None:
+        self.file = file
+        self.offset = 0
+        self._partial = b""
+        self._inode: int | None = None
+        self._head = b""
+
+    def _restart(self) -> None:
+        self.offset = 0
+        self._partial = b""
+        self._inode = None
+        self._head = b""
+
+    def read_lines(self) -> list[str] | None:
+        """
+        return: list of new complete lines, or None if the file was truncated
+                or replaced and has to be read from the start
+        """
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return []
+        size = stat.st_size
+        # a replaced file is a new inode, or a file shorter than the offset,
+        # or one whose first bytes changed when rewritten in place
+        if size < self.offset or (
+            self._inode is not None and stat.st_ino != self._inode
+        ):
+            self._restart()
+            return None
+        self._inode = stat.st_ino
+        if size == self.offset:
+            return []
+        with open(self.file, "rb") as f:
+            if self._head and f.read(len(self._head)) != self._head:
+                self._restart()
+                return None
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        if len(self._head) < _HEAD_BYTES:
+            self._head = (self._head + data)[:_HEAD_BYTES]
+        self.offset += len(data)
+        data = self._partial + data
+        # the last line is only parsed once its newline has been written
+        end = data.rfind(b"\n") + 1
+        self._partial = data[end:]
+        return data[:end].decode().splitlines()
+
+    def flush(self) -> list[str]:
+        """
+        return: the trailing line without newline, if any
+        """
+        line, self._partial = self._partial.decode(), b""
+        return [line] if line.strip() else []
+
+
+class _Parser(abc.ABC):
+    """
+    Incremental processing of raw lines of one instrument, state such as
+    height or pending 1 s averages is carried between calls
+    """
+
+    header = True
+
+    def __init__(self) -> None:
+        self.first_line: str | None = None
+
+    def _read(self, lines: list[str]) -> pd.DataFrame:
+        text = "\n".join(lines)
+        if self.header:
+            # set by process before the first lines are read
+            assert self.first_line is not None
+            return pd.read_csv(io.StringIO(self.first_line + "\n" + text))
+        return pd.read_csv(io.StringIO(text), header=None, dtype=str)
+
+    def process(self, lines: list[str]) -> pd.DataFrame | None:
+        """
+        lines: new complete lines, the first line of the file included
+        return: processed rows, or None if there are none yet
+        """
+        if self.first_line is None and lines:
+            # header line, or the skipped first line of mcda files
+            self.first_line = lines[0]
+            lines = lines[1:]
+        lines = [x for x in lines if x.strip()]
+        if not lines:
+            return None
+        df = self._process(self._read(lines))
+        return df if len(df) else None
+
+    @abc.abstractmethod
+    def _process(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        df: new rows read from the lines
+        return: processed rows
+        """
+
+    def flush(self) -> pd.DataFrame | None:
+        """
+        return: processed rows held back until more data arrives, if any
+        """
+        return None
+
+
+class _CPCParser(_Parser):
+    def _process(self, df: pd.DataFrame) -> pd.DataFrame:
+        return _process_cpc_frame(df)
+
+
+class _BMEParser(_Parser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.integrator = HeightIntegrator()
+        self.date_format: str | None = None
+
+    def _process(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.dropna(axis=0)
+        if not df.empty and self.date_format is None:
+            self.date_format = guess_date_format(df["date"], df["time"])
+        return _process_bme_frame(df, self.integrator, self.date_format)
+
+
+class _MCDAParser(_Parser):
+    header = False
+
+    def __init__(self, size: str | Sequence[float] | NDArray[np.float64]) -> None:
+        super().__init__()
+        self.geometry = get_bin_geometry("mcda", size)
+
+    def _process(self, df: pd.DataFrame) -> pd.DataFrame:
+        return _process_mcda_frame(df, self.geometry)
+
+
+class _POPSParser(_Parser):
+    """
+    Rows of the last second are held back until a later second is written,
+    so that each 1 s average is complete when it is emitted
+    """
+
+    def __init__(
+        self, size: Sequence[float] | NDArray[np.float64] | None, drop_aux: bool
+    ) -> None:
+        super().__init__()
+        self.dlog_bin = get_bin_geometry("pops", size).dlog_bin
+        self.drop_aux = drop_aux
+        self.pending: pd.DataFrame | None = None
+
+    def _process(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.dropna(axis=0)
+        if self.pending is not None:
+            df = pd.concat([self.pending, df], ignore_index=True)
+        second = pd.to_datetime(df["DateTime"], unit="s").dt.floor("1s")
+        complete = (second < second.max()).to_numpy()
+        self.pending = df[~complete]
+        return self._emit(df[complete])
+
+    def _emit(self, df: pd.DataFrame) -> pd.DataFrame:
+        return _process_pops_frame(
+            df.reset_index(drop=True), self.dlog_bin, self.drop_aux
+        )
+
+    def flush(self) -> pd.DataFrame | None:
+        if self.pending is None or self.pending.empty:
+            return None
+        df, self.pending = self.pending, None
+        return self._emit(df)
+
+
+def _make_parser(
+    instrument: Instrument,
+    size: str | Sequence[float] | NDArray[np.float64] | None,
+    drop_aux: bool,
+) -> _Parser:
+    if instrument == "cpc":
+        return _CPCParser()
+    if instrument == "bme":
+        return _BMEParser()
+    if instrument == "pops":
+        return _POPSParser(size, drop_aux)  # type: ignore[arg-type]
+    if instrument == "mcda":
+        if size is None:
+            raise ValueError("size is required for mcda")
+        return _MCDAParser(size)
+    raise ValueError(
+        f"instrument must be one of ['cpc', 'bme', 'pops', 'mcda'], got {instrument!r}"
+    )
+
+
+def follow(
+    file: str | PathLike[str],
+    instrument: Instrument,
+    size: str | Sequence[float] | NDArray[np.float64] | None = None,
+    drop_aux: bool = True,
+    poll_interval: float = 0.2,
+    stop: threading.Event | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Follow a growing instrument log file and process newly appended lines,
+    only complete lines (ending with a newline) are parsed
+    file: path to the csv file being written (string or PathLike), it may
+          not exist yet
+    instrument: 'cpc', 'bme', 'pops' or 'mcda'
+    size: mcda size category string or array-like of 256 mid-bin values,
+          pops optional array-like of 17 bin edges, see preprocess_mcda and
+          preprocess_pops
+    drop_aux: pops only, if True drop auxiliary columns (default True)
+    poll_interval: seconds between checks of the file size (default 0.2)
+    stop: optional threading.Event, following ends once it is set and
+          the remaining lines are processed
+    return: iterator of processed dataframe blocks with the columns of the
+            preprocess_* function of the instrument and a continuing index.
+            BME height is carried between blocks, POPS rows of the latest
+            second are held back until the next second starts.
+            If the file is truncated or replaced, processing restarts.
+    """
+    tail = _LineTail(file)
+    parser = _make_parser(instrument, size, drop_aux)
+    start = 0
+
+    def numbered(df: pd.DataFrame | None) -> Iterator[pd.DataFrame]:
+        nonlocal start
+        if df is not None:
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
+
+    while True:
+        stopping = stop is not None and stop.is_set()
+        lines = tail.read_lines()
+        if lines is None:
+            parser = _make_parser(instrument, size, drop_aux)
+            lines = tail.read_lines() or []
+        if stopping:
+            lines += tail.flush()
+        yield from numbered(parser.process(lines))
+        if stopping:
+            yield from numbered(parser.flush())
+            return
+        if not lines:
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+
+# errors of reading and processing a log file, or of the callback, that end the
+# follower thread and are raised again by Follower.stop
+_FOLLOW_ERRORS = (OSError, ValueError, KeyError, IndexError, TypeError)
+
+
+class Follower:
+    """
+    Follow a growing instrument log file in a background thread and pass each
+    processed block to a callback, see follow for the arguments
+
+    file: path to the csv file being written (string or PathLike)
+    instrument: 'cpc', 'bme', 'pops' or 'mcda'
+    callback: optional function called with each processed block
+    keep: bool, if True keep the blocks so frame() returns all rows so far
+
+    An error that ends the thread is kept in error and raised by stop(), and so
+    when leaving the with block.
+
+    Usage:
+        with Follower("cpc.csv", "cpc", callback=print) as follower:
+            ...  # while flying
+        df = follower.frame()
+    """
+
+    def __init__(
+        self,
+        file: str | PathLike[str],
+        instrument: Instrument,
+        callback: Callable[[pd.DataFrame], None] | None = None,
+        size: str | Sequence[float] | NDArray[np.float64] | None = None,
+        drop_aux: bool = True,
+        poll_interval: float = 0.2,
+        keep: bool = True,
+    ) -> None:
+        self.callback = callback
+        self.keep = keep
+        self.error: Exception | None = None
+        self._blocks: list[pd.DataFrame] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._iterator = follow(
+            file, instrument, size, drop_aux, poll_interval, self._stop
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        try:
+            for df in self._iterator:
+                if self.keep:
+                    with self._lock:
+                        self._blocks.append(df)
+                if self.callback is not None:
+                    self.callback(df)
+        except _FOLLOW_ERRORS as e:
+            self.error = e
+
+    def start(self) -> Self:
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Process the remaining lines, end the thread and raise the error that
+        ended it, if any
+        timeout: optional seconds to wait for the thread
+        """
+        self._stop.set()
+        self._thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def frame(self) -> pd.DataFrame:
+        """
+        return: all processed rows so far (keep=True)
+        """
+        with self._lock:
+            blocks = list(self._blocks)
+        return pd.concat(blocks) if blocks else pd.DataFrame({})
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *args: object) -> None:
+        self.stop()
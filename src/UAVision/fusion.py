@@ -0,0 +1,192 @@
+from typing import Any, Literal, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from UAVision.profiling import stage
+
+Method = Literal["nearest", "backward", "forward"]
+TimedeltaLike = str | pd.Timedelta | int
+TimeUnit = Literal["s", "ms", "us", "ns"]
+
+# nanoseconds of the datetime units, finest first
+_UNIT_NS: dict[TimeUnit, int] = {"ns": 1, "us": 10**3, "ms": 10**6, "s": 10**9}
+
+
+def _as_ns(datetime: Any) -> NDArray[np.int64]:
+    # UTC nanoseconds, tz-aware datetimes are converted first
+    datetime = pd.DatetimeIndex(datetime).as_unit("ns")
+    if datetime.tz is not None:
+        datetime = datetime.tz_convert(None)
+    return datetime.to_numpy().view(np.int64)
+
+
+def _offset(value: TimedeltaLike | None, period: str | pd.Timedelta) -> int:
+    # integers are numbers of periods, e.g. a lag from calculate_lag on a 1 s frame
+    if value is None:
+        return 0
+    if isinstance(value, (int, np.integer)):
+        return int(value) * pd.Timedelta(period).value
+    return pd.Timedelta(value).value
+
+
+def match_indices(
+    times: NDArray[np.int64],
+    target: NDArray[np.int64],
+    method: Method = "nearest",
+    tolerance: int | None = None,
+) -> NDArray[np.intp]:
+    """
+    For each target time the row of the closest time, by bisection of the
+    sorted times, the same rows as pd.merge_asof (ties of nearest go backward)
+    times: sorted int64 times of the rows
+    target: int64 times to match, any order
+    method: 'nearest', 'backward' (last time at or before the target) or
+            'forward' (first time at or after the target) (default 'nearest')
+    tolerance: optional largest distance of a match, same unit as the times
+    return: array of row indices, -1 where there is no match
+    """
+    n = len(times)
+    if n == 0:
+        return np.full(len(target), -1, dtype=np.intp)
+    after = np.searchsorted(times, target, side="left")
+    before = np.searchsorted(times, target, side="right") - 1
+    if method == "backward":
+        index = before
+    elif method == "forward":
+        index = np.where(after < n, after, -1)
+    elif method == "nearest":
+        largest = np.iinfo(np.int64).max
+        distance_before = np.where(
+            before >= 0, target - times[np.maximum(before, 0)], largest
+        )
+        distance_after = np.where(
+            after < n, times[np.minimum(after, n - 1)] - target, largest
+        )
+        index = np.where(distance_after < distance_before, after, before)
+    else:
+        raise ValueError(
+            f"method must be 'nearest', 'backward' or 'forward', got {method!r}"
+        )
+    if tolerance is not None:
+        found = index >= 0
+        distance = np.abs(target[found] - times[index[found]])
+        index[np.flatnonzero(found)[distance > tolerance]] = -1
+    return index
+
+
+def _per_instrument(value: Any, name: str, default: Any = None) -> Any:
+    if isinstance(value, Mapping):
+        return value.get(name, default)
+    return default if value is None else value
+
+
+def fuse(
+    products: Mapping[str, pd.DataFrame],
+    base: str | Sequence | pd.DatetimeIndex | None = None,
+    method: Method | Mapping[str, Method] = "nearest",
+    tolerance: TimedeltaLike | Mapping[str, TimedeltaLike] | None = None,
+    lags: Mapping[str, TimedeltaLike] | None = None,
+    columns: Mapping[str, Sequence[str]] | None = None,
+    period: str | pd.Timedelta = "1s",
+) -> pd.DataFrame:
+    """
+    Align several processed products on one time base in one pass, each
+    product is matched by bisection of its sorted datetimes, so the cost is
+    linear in rows times products
+    products: dict of instrument name and dataframe with a datetime column,
+              e.g. {"cpc": preprocess_cpc(...), "bme": preprocess_bme(...)}
+    base: time base, the name of a product (its shifted datetimes), or
+          datetimes. If None the sorted union of all shifted datetimes
+    method: 'nearest', 'backward' or 'forward', or dict of instrument and
+            method, see match_indices, 'nearest' for the instruments not in
+            the dict (default 'nearest')
+    tolerance: optional largest distance of a match (Timedelta or string,
+               integer in periods), or dict of instrument and tolerance,
+               e.g. {"mcda": "10s"} for the 10 s mcda averages
+    lags: optional dict of instrument and time added to its datetimes before
+          matching, integer in periods (e.g. from calculate_lag) or Timedelta
+    columns: optional dict of instrument and the columns taken from it,
+             default all columns but datetime
+    period: length of an integer lag or tolerance (default '1s')
+    return: dataframe of datetime (the time base) and the columns of all
+            products, NaN where a product has no match
+    """
+    times: dict[str, NDArray[np.int64]] = {}
+    rows: dict[str, NDArray[np.intp] | None] = {}
+    names: dict[str, list[str]] = {}
+    for name, df in products.items():
+        t = _as_ns(df["datetime"]) + _offset(_per_instrument(lags, name), period)
+        order = None
+        if (t[1:] < t[:-1]).any():
+            order = np.argsort(t, kind="stable")
+            t = t[order]
+        times[name] = t
+        rows[name] = order
+        chosen = _per_instrument(columns, name)
+        names[name] = [
+            x for x in (df.columns if chosen is None else chosen) if x != "datetime"
+        ]
+    seen: dict[str, str] = {}
+    for name, labels in names.items():
+        for x in labels:
+            if x in seen:
+                raise ValueError(
+                    f"column {x!r} is in {seen[x]!r} and {name!r}, "
+                    "select the columns of each product with columns"
+                )
+            seen[x] = name
+
+    if base is None:
+        if products:
+            target = np.unique(np.concatenate([times[x] for x in products]))
+        else:
+            target = np.zeros(0, dtype=np.int64)
+    elif isinstance(base, str):
+        if base not in products:
+            raise KeyError(f"base {base!r} is not one of the products")
+        target = times[base]
+    else:
+        target = _as_ns(base)
+    target = target.astype(np.int64, copy=False)
+
+    # the time base keeps the finest unit of the products when it is exact
+    datetime = pd.DatetimeIndex(target.view("M8[ns]"))
+    units = {pd.DatetimeIndex(x["datetime"]).unit for x in products.values()}
+    unit: TimeUnit = next((x for x in _UNIT_NS if x in units), "ns")
+    if (target % _UNIT_NS[unit] == 0).all():
+        datetime = datetime.as_unit(unit)
+    data: dict[str, Any] = {"datetime": datetime}
+    for name, df in products.items():
+        tolerance_ = _per_instrument(tolerance, name)
+        with stage("fusion.match", len(target)):
+            index = match_indices(
+                times[name],
+                target,
+                _per_instrument(method, name, "nearest"),
+                None if tolerance_ is None else _offset(tolerance_, period),
+            )
+        found = index >= 0
+        order = rows[name]
+        if order is not None:
+            index = np.where(found, order[np.maximum(index, 0)], -1)
+        with stage("fusion.take", len(target)):
+            for x in names[name]:
+                values = df[x].to_numpy()
+                if found.all():
+                    data[x] = values[index]
+                    continue
+                if values.dtype.kind in "biu":
+                    values = values.astype(np.float64)
+                if len(values):
+                    taken = values[np.maximum(index, 0)]
+                else:
+                    taken = np.empty(len(index), values.dtype)
+                if values.dtype.kind in "mM":
+                    taken[~found] = np.datetime64("NaT")
+                else:
+                    taken = taken.astype(np.result_type(taken.dtype, np.float32))
+                    taken[~found] = np.nan
+                data[x] = taken
+    return pd.DataFrame(data, copy=False)
@@ -2,10 +2,37 @@ import pandas as pd
 import glob
 import os
 import re
-from functools import reduce
 import argparse
 from os import PathLike
 import csv
+import json
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Literal
+
+from UAVision import __version__
+from UAVision.columnar import columnar_path, save_columnar
+from UAVision.profiling import stage
+from UAVision.utils import (
+    combine_date_time,
+    compact_dtypes,
+    file_sha256,
+    guess_date_format,
+    guess_datetime_format,
+    parse_datetime,
+    resample_sparse,
+)
+
+logger = logging.getLogger(__name__)
+
+OutputFormat = Literal["csv", "parquet", "feather", "npy"]
+
+MANIFEST_NAME = "merge_manifest.json"
+
+# parse plans per instrument name: delimiter, header, numeric dtypes and the
+# columns the datetime is built from, derived from the first file read
+_PARSE_PLANS: dict[str, dict[str, Any]] = {}
 
 
 def _detect_delimiter(path: str) -> str:
@@ -18,86 +45,423 @@ def _detect_delimiter(path: str) -> str:
         return ","
 
 
-def merge_sensor_data(
-    dir_in: str | PathLike[str], dir_out: str | PathLike[str]
-) -> None:
+def _datetime_source(columns: list[str]) -> list[str]:
+    if "datetime" in columns:
+        return ["datetime"]
+    if "time" not in columns:
+        return ["date"]
+    return ["date", "time"]
+
+
+def _make_parse_plan(df: pd.DataFrame, sep: str) -> dict[str, Any]:
+    columns = [str(x) for x in df.columns]
+    return {
+        "sep": sep,
+        "columns": columns,
+        "dtype": {
+            str(k): str(v)
+            for k, v in df.dtypes.items()
+            if pd.api.types.is_numeric_dtype(v)
+        },
+        "datetime": _datetime_source([x.replace(" ", "") for x in columns]),
+    }
+
+
+def _read_sensor_file(path: str, instrument: str) -> pd.DataFrame:
     """
-    Merge sensor data from multiple files in subdirectories.
+    Read a sensor file with the cached parse plan of its instrument.
+    The delimiter is sniffed and a new plan is made for the first file of an
+    instrument, or when a file does not match the plan.
+    """
+    plan = _PARSE_PLANS.get(instrument)
+    if plan is not None:
+        try:
+            df = pd.read_csv(
+                path,
+                index_col=False,
+                sep=plan["sep"],
+                dtype=plan["dtype"],
+                engine="c",
+            )
+            if [str(x) for x in df.columns] == plan["columns"]:
+                return df
+        except (ValueError, TypeError):
+            pass
+    sep = _detect_delimiter(path)
+    df = pd.read_csv(path, index_col=False, sep=sep)
+    _PARSE_PLANS[instrument] = _make_parse_plan(df, sep)
+    return df
 
-    dir_in: input directory containing subdirectories with sensor files
-    dir_out: output directory for merged CSV files
+
+def load_parse_plans(path: str | PathLike[str]) -> None:
+    """
+    Load parse plans saved with save_parse_plans into the cache.
+
+    path: json file (string or PathLike)
     return: None
     """
-    dir_in = str(dir_in).replace("\\", "/") + "/"
-    dir_out = str(dir_out).replace("\\", "/") + "/"
+    with open(path) as fh:
+        _PARSE_PLANS.update(json.load(fh))
 
-    sub_dir = [f.path for f in os.scandir(dir_in) if f.is_dir()]
+
+def save_parse_plans(path: str | PathLike[str]) -> None:
+    """
+    Save the cached parse plans, so later runs read files without sniffing.
+
+    path: json file (string or PathLike)
+    return: None
+    """
+    with open(path, "w") as fh:
+        json.dump(_PARSE_PLANS, fh, indent=1)
+
+
+def _set_parse_plans(plans: dict[str, dict[str, Any]]) -> None:
+    _PARSE_PLANS.update(plans)
+
+
+def _list_sensor_files(sub_dir_: str) -> list[str]:
     file_types = [".csv", ".txt"]
-    for sub_dir_ in sub_dir:
-        file_path = []
-        for file_type in file_types:
-            file_path.extend([x for x in glob.glob(sub_dir_ + "/*" + file_type)])
-        file_name = [os.path.basename(x).rsplit(".", 1)[0] for x in file_path]
-        instrument_name = [re.sub(r"[\.\-_][0-9]+", "", x) for x in file_name]
-        file_summary = pd.DataFrame(
-            {
-                "file_path": file_path,
-                "file_name": file_name,
-                "instrument_name": instrument_name,
-            }
-        )
+    file_path = []
+    for file_type in file_types:
+        file_path.extend([x for x in glob.glob(sub_dir_ + "/*" + file_type)])
+    return file_path
+
+
+def _output_path(sub_dir_: str, dir_out: str, output_format: OutputFormat) -> str:
+    if output_format == "csv":
+        return dir_out + sub_dir_.split("/")[-1] + "_merged.csv"
+    return str(
+        columnar_path(dir_out + sub_dir_.split("/")[-1] + "_merged", output_format)
+    )
+
+
+def _folder_state(
+    sub_dir_: str, previous: dict[str, dict[str, Any]]
+) -> dict[str, dict[str, Any]]:
+    """
+    Size, mtime and sha256 of the input files of a flight folder.
+    The hash of a file is reused from previous when its size and mtime are unchanged.
+    """
+    state: dict[str, dict[str, Any]] = {}
+    for path in sorted(_list_sensor_files(sub_dir_)):
+        stat = os.stat(path)
+        entry: dict[str, int | str] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        old = previous.get(path)
+        if old is not None and all(old[k] == v for k, v in entry.items()):
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_sha256(path)
+        state[path] = entry
+    return state
+
+
+def _is_stale(
+    record: dict[str, Any] | None,
+    state: dict[str, dict[str, Any]],
+    file_out: str,
+    compact: bool = False,
+) -> bool:
+    if record is None or not os.path.exists(file_out):
+        return True
+    if record["version"] != __version__ or record["output"] != file_out:
+        return True
+    if record.get("compact", False) != compact:
+        return True
+    old = record["files"]
+    return old.keys() != state.keys() or any(
+        old[k]["sha256"] != v["sha256"] for k, v in state.items()
+    )
+
+
+def _load_manifest(dir_out: str) -> dict[str, Any]:
+    path = dir_out + MANIFEST_NAME
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _write_manifest(dir_out: str, manifest: dict[str, Any]) -> None:
+    path = dir_out + MANIFEST_NAME
+    with open(path + ".tmp", "w") as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(path + ".tmp", path)
+
 
-        data: dict[str, pd.DataFrame] = {}
+# errors of a single folder, e.g. unreadable or malformed files, that
+# errors='collect' records without stopping the other folders
+_FOLDER_ERRORS = (OSError, ValueError, KeyError, IndexError, TypeError)
+
+
+def _merge_folder(
+    sub_dir_: str,
+    dir_out: str,
+    output_format: OutputFormat = "csv",
+    compact: bool = False,
+) -> tuple[str, dict[str, dict[str, Any]]]:
+    """
+    Merge the sensor files of one flight folder and write the merged file.
+
+    sub_dir_: flight folder containing sensor files
+    dir_out: output directory, ending with '/'
+    output_format: see merge_sensor_data
+    compact: see merge_sensor_data
+    return: path of the merged file and the parse plans used
+    """
+    file_path = _list_sensor_files(sub_dir_)
+    file_name = [os.path.basename(x).rsplit(".", 1)[0] for x in file_path]
+    instrument_name = [re.sub(r"[\.\-_][0-9]+", "", x) for x in file_name]
+    file_summary = pd.DataFrame(
+        {
+            "file_path": file_path,
+            "file_name": file_name,
+            "instrument_name": instrument_name,
+        }
+    )
+
+    data: dict[str, pd.DataFrame] = {}
+    with stage("merge_sensor_data.read_csv") as s:
         for instrument, grp in file_summary.groupby("instrument_name"):
             instrument = str(instrument)
             dfs: list[pd.DataFrame] = [
-                pd.read_csv(x, index_col=False, sep=_detect_delimiter(x))
-                for x in grp.file_path
+                _read_sensor_file(x, instrument) for x in grp.file_path
             ]
             data[instrument] = pd.concat(dfs, ignore_index=True)
+        s.rows = sum(len(x) for x in data.values())
 
-        for key in data.keys():
-            data[key] = data[key].dropna(axis=0, how="all")
-            data[key].columns = data[key].columns.str.replace(" ", "")
-            if "datetime" in data[key].columns:
-                data[key]["datetime"] = pd.to_datetime(data[key]["datetime"])
+    for key in data.keys():
+        data[key] = data[key].dropna(axis=0, how="all")
+        data[key].columns = data[key].columns.str.replace(" ", "")
+        # the datetime format is detected once per instrument and kept in the plan
+        plan = _PARSE_PLANS[key]
+        with stage("merge_sensor_data.datetime", len(data[key])):
+            if plan["datetime"] == ["datetime"]:
+                if "datetime_format" not in plan:
+                    plan["datetime_format"] = guess_datetime_format(
+                        data[key]["datetime"]
+                    )
+                data[key]["datetime"] = parse_datetime(
+                    data[key]["datetime"], plan["datetime_format"]
+                )
+            elif plan["datetime"] == ["date"]:
+                if "datetime_format" not in plan:
+                    plan["datetime_format"] = guess_datetime_format(data[key]["date"])
+                data[key]["datetime"] = parse_datetime(
+                    data[key]["date"], plan["datetime_format"]
+                )
+                data[key].drop(["date"], axis=1, inplace=True)
             else:
-                if "time" not in data[key].columns:
-                    data[key]["datetime"] = pd.to_datetime(data[key]["date"])
-                    data[key].drop(["date"], axis=1, inplace=True)
-                else:
-                    data[key]["datetime"] = pd.to_datetime(
-                        data[key]["date"].astype(str)
-                        + " "
-                        + data[key]["time"].astype(str)
+                if "datetime_format" not in plan:
+                    plan["datetime_format"] = guess_date_format(
+                        data[key]["date"], data[key]["time"]
                     )
-                    data[key].drop(["date", "time"], axis=1, inplace=True)
-            data[key] = data[key].set_index("datetime").resample("1s").mean()
-            data[key] = data[key].reset_index()
-            data[key] = data[key].dropna()
-            data[key].columns = [
-                x + "_" + key if "datetime" not in x else x for x in data[key].columns
-            ]
+                data[key]["datetime"] = combine_date_time(
+                    data[key]["date"], data[key]["time"], plan["datetime_format"]
+                )
+                data[key].drop(["date", "time"], axis=1, inplace=True)
+        with stage("merge_sensor_data.resample", len(data[key])):
+            data[key] = resample_sparse(data[key]).dropna()
+        data[key].columns = [
+            x + "_" + key if "datetime" not in x else x for x in data[key].columns
+        ]
 
-        data_merged = reduce(
-            lambda left, right: pd.merge(left, right, on=["datetime"], how="outer"),
-            data.values(),
+    with stage("merge_sensor_data.merge") as s:
+        # align all instruments on the sorted union of their timestamps in one step
+        data_merged = pd.concat(
+            [x.set_index("datetime") for x in data.values()],
+            axis=1,
+            join="outer",
+            sort=True,
         )
-        data_merged = data_merged.set_index("datetime")
-        data_merged = data_merged.sort_index()
         data_merged.reset_index(inplace=True)
-        data_merged.to_csv(
-            dir_out + sub_dir_.split("/")[-1] + "_merged.csv", index=False
+        if compact:
+            data_merged = compact_dtypes(data_merged)
+        s.rows = len(data_merged)
+    file_out = _output_path(sub_dir_, dir_out, output_format)
+    with stage("merge_sensor_data.write", len(data_merged)):
+        if output_format == "csv":
+            data_merged.to_csv(file_out, index=False)
+        else:
+            save_columnar(data_merged, file_out, output_format)
+    return file_out, {x: _PARSE_PLANS[x] for x in data}
+
+
+def merge_sensor_data(
+    dir_in: str | PathLike[str],
+    dir_out: str | PathLike[str],
+    output_format: OutputFormat = "csv",
+    workers: int = 1,
+    incremental: bool = False,
+    plan_file: str | PathLike[str] | None = None,
+    compact: bool = False,
+    errors: Literal["raise", "collect"] = "raise",
+) -> dict[str, BaseException]:
+    """
+    Merge sensor data from multiple files in subdirectories.
+
+    dir_in: input directory containing subdirectories with sensor files
+    dir_out: output directory for merged CSV files
+    output_format: 'csv' (default), or a columnar format 'parquet', 'feather'
+                   (require pyarrow) or 'npy', see UAVision.columnar.load_columnar
+    workers: number of processes merging flight folders concurrently (default 1)
+    incremental: bool, if True only merge folders whose input files (size, mtime,
+                 sha256), output or package version changed since the last run,
+                 as recorded in dir_out/merge_manifest.json. Only the package
+                 __version__ is recorded, not the code, so an edited checkout of
+                 the same version reuses the old outputs, delete the manifest to
+                 merge everything again (default False)
+    plan_file: optional json file to load and save the per-instrument parse plans
+               (delimiter, dtypes, datetime columns), so files are read without
+               sniffing across runs
+    compact: bool, if True store the values as float32 once resampled in
+             float64, relative error at most UAVision.utils.FLOAT32_RTOL, for
+             csv output the shortest decimal of the float32 is written, at
+             most twice that (default False)
+    errors: 'raise' (default) to raise the error of the first folder that fails
+            to merge, 'collect' to log and return the errors of failed folders
+            (unreadable or malformed files) and merge the others regardless
+    return: dict of folders that failed to merge and their error,
+            empty unless errors='collect'
+    """
+    dir_in = str(dir_in).replace("\\", "/") + "/"
+    dir_out = str(dir_out).replace("\\", "/") + "/"
+
+    sub_dir = [f.path for f in os.scandir(dir_in) if f.is_dir()]
+    to_merge = sub_dir
+    if incremental:
+        records: dict[str, Any] = _load_manifest(dir_out).get("folders", {})
+        states = {
+            x: _folder_state(x, records.get(x, {}).get("files", {})) for x in sub_dir
+        }
+        to_merge = [
+            x
+            for x in sub_dir
+            if _is_stale(
+                records.get(x),
+                states[x],
+                _output_path(x, dir_out, output_format),
+                compact,
+            )
+        ]
+
+    if plan_file is not None and os.path.exists(plan_file):
+        load_parse_plans(plan_file)
+
+    failed: dict[str, BaseException] = {}
+    # stages of folders merged in worker processes are not recorded, the
+    # UAVISION_PROFILE report is only written by the main process
+    with stage("merge_sensor_data.folders", len(to_merge)):
+        if workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_set_parse_plans,
+                initargs=(_PARSE_PLANS,),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _merge_folder, x, dir_out, output_format, compact
+                    ): x
+                    for x in to_merge
+                }
+                for future in as_completed(futures):
+                    error = future.exception()
+                    if error is not None:
+                        if errors == "raise" or not isinstance(error, _FOLDER_ERRORS):
+                            for x in futures:
+                                x.cancel()
+                            raise error
+                        failed[futures[future]] = error
+                    else:
+                        _PARSE_PLANS.update(future.result()[1])
+        else:
+            for sub_dir_ in to_merge:
+                try:
+                    _merge_folder(sub_dir_, dir_out, output_format, compact)
+                except _FOLDER_ERRORS as error:
+                    if errors == "raise":
+                        raise
+                    failed[sub_dir_] = error
+
+    if plan_file is not None:
+        save_parse_plans(plan_file)
+
+    if incremental:
+        # failed folders are left out so they are retried on the next run
+        _write_manifest(
+            dir_out,
+            {
+                "version": __version__,
+                "folders": {
+                    x: {
+                        "version": __version__,
+                        "output": _output_path(x, dir_out, output_format),
+                        "compact": compact,
+                        "files": states[x],
+                    }
+                    for x in sub_dir
+                    if x not in failed
+                },
+            },
         )
-    print(f"{len(sub_dir)} folders merged")
+        logger.info("%d folders unchanged", len(sub_dir) - len(to_merge))
+    for sub_dir_, reason in failed.items():
+        logger.error("Failed to merge %s: %r", sub_dir_, reason)
+    logger.info("%d folders merged", len(to_merge) - len(failed))
+    return failed
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Description for arguments")
     parser.add_argument("dir_in", help="Input directory", type=str)
     parser.add_argument("dir_out", help="Output directory", type=str)
+    parser.add_argument(
+        "--format",
+        help="Output format",
+        choices=["csv", "parquet", "feather", "npy"],
+        default="csv",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of flight folders merged in parallel",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--plan-file",
+        help="Json file caching the per-instrument parse plans across runs",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Only merge folders whose input files changed since the last run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compact",
+        help="Store the resampled values as float32",
+        action="store_true",
+    )
     argument = parser.parse_args()
 
-    merge_sensor_data(argument.dir_in, argument.dir_out)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    failed = merge_sensor_data(
+        argument.dir_in,
+        argument.dir_out,
+        output_format=argument.format,
+        workers=argument.workers,
+        incremental=argument.incremental,
+        plan_file=argument.plan_file,
+        compact=argument.compact,
+        errors="collect",
+    )
 
+    if failed:
+        print(f"Failed to merge {len(failed)} folders:")
+        for folder, reason in failed.items():
+            print(f"  {folder}: {reason!r}")
+        sys.exit(1)
     print("Finished merging files")
@@ -2,40 +2,145 @@ import pandas as pd
 import glob
 import os
 import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import pairwise
 from os import PathLike
 
+from UAVision.profiling import stage
 
-def merge_wind_data(dir_in: str | PathLike[str], dir_out: str | PathLike[str]) -> None:
+logger = logging.getLogger(__name__)
+
+
+def _flight_start_time(file: str) -> pd.Timestamp:
+    """
+    Flight start time encoded at the end of the wind file name
+    file: path ending with YYYY-MM-DD_HH-MM-SS.csv
+    return: start time
+    """
+    file_name = os.path.basename(file)
+    return pd.to_datetime(file_name[-23:-4], format="%Y-%m-%d_%H-%M-%S")
+
+
+def _read_wind_file(file: str) -> pd.DataFrame:
+    start_time = _flight_start_time(file)
+    df = pd.read_csv(file)
+    df["datetime"] = start_time + pd.to_timedelta(df["Flight time"])
+    return df
+
+
+def _select_flights(
+    files: list[str],
+    start: pd.Timestamp | None,
+    end: pd.Timestamp | None,
+) -> list[str]:
+    """
+    Select the files of flights that can overlap [start, end], from the start
+    times in the file names. A flight is assumed to end before the next one starts,
+    the end of the last flight is unknown, so it is kept and its rows are
+    filtered after reading, see _clip.
+    """
+    start_times = {x: _flight_start_time(x) for x in files}
+    ordered = sorted(files, key=lambda x: start_times[x])
+    next_start = {x: start_times[y] for x, y in pairwise(ordered)}
+    selected = []
+    for file in files:
+        if end is not None and start_times[file] > end:
+            continue
+        if start is not None and file in next_start and next_start[file] <= start:
+            continue
+        selected.append(file)
+    return selected
+
+
+def _clip(
+    dfs: list[pd.DataFrame],
+    start: pd.Timestamp | None,
+    end: pd.Timestamp | None,
+) -> list[pd.DataFrame]:
+    """
+    Rows of the flights within [start, end], flights without rows are dropped,
+    the columns are kept when no row is left
+    """
+    clipped = []
+    for df in dfs:
+        inside = pd.Series(True, index=df.index)
+        if start is not None:
+            inside &= df["datetime"] >= start
+        if end is not None:
+            inside &= df["datetime"] <= end
+        if inside.all():
+            clipped.append(df)
+        elif inside.any():
+            clipped.append(df[inside])
+    if not clipped and dfs:
+        clipped.append(dfs[0].iloc[:0])
+    return clipped
+
+
+def merge_wind_data(
+    dir_in: str | PathLike[str],
+    dir_out: str | PathLike[str],
+    workers: int = 1,
+    start: str | pd.Timestamp | None = None,
+    end: str | pd.Timestamp | None = None,
+) -> None:
     """
     Merge wind data from multiple CSV files.
 
     dir_in: input directory containing wind CSV files
     dir_out: output directory for merged wind CSV file
+    workers: number of threads reading files concurrently (default 1)
+    start: optional, only merge rows at or after start
+    end: optional, only merge rows at or before end
     return: None
     """
     dir_in = str(dir_in).replace("\\", "/") + "/"
     dir_out = str(dir_out).replace("\\", "/") + "/"
 
     file_path_wind = [x for x in glob.glob(dir_in + "/*.csv")]
-    df = pd.DataFrame({})
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    if start is not None or end is not None:
+        file_path_wind = _select_flights(file_path_wind, start, end)
 
-    for file in file_path_wind:
-        file_name = os.path.basename(file)
-        start_time = pd.to_datetime(file_name[-23:-4], format="%Y-%m-%d_%H-%M-%S")
-        df_ = pd.read_csv(file)
-        df_["datetime"] = start_time + pd.to_timedelta(df_["Flight time"])
-        df = pd.concat([df, df_], ignore_index=True)
+    # files are read lazily and concatenated once
+    with stage("merge_wind_data.read_csv") as s:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                dfs = list(executor.map(_read_wind_file, file_path_wind))
+        else:
+            dfs = [_read_wind_file(x) for x in file_path_wind]
+        s.rows = sum(len(x) for x in dfs)
+    if start is not None or end is not None:
+        dfs = _clip(dfs, start, end)
+    with stage("merge_wind_data.merge", s.rows):
+        df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame({})
 
-    df.to_csv(dir_out + "wind_merged.csv", index=False)
-    print(f"{len(file_path_wind)} files merged")
+    with stage("merge_wind_data.write", len(df)):
+        df.to_csv(dir_out + "wind_merged.csv", index=False)
+    # files selected around start or end may have no row left after clipping
+    logger.info("%d files merged, %d rows", sum(len(x) > 0 for x in dfs), len(df))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Description for arguments")
     parser.add_argument("dir_in", help="Input directory", type=str)
     parser.add_argument("dir_out", help="Output directory", type=str)
+    parser.add_argument(
+        "--workers", help="Number of files read in parallel", type=int, default=1
+    )
+    parser.add_argument("--start", help="Start of time window", type=str, default=None)
+    parser.add_argument("--end", help="End of time window", type=str, default=None)
     argument = parser.parse_args()
 
-    merge_wind_data(argument.dir_in, argument.dir_out)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    merge_wind_data(
+        argument.dir_in,
+        argument.dir_out,
+        workers=argument.workers,
+        start=argument.start,
+        end=argument.end,
+    )
 
     print("Finished merging files")
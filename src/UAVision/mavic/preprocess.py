@@ -1,23 +1,88 @@
 from __future__ import annotations
+import logging
 import numpy as np
 from numpy.typing import NDArray
-import importlib.resources
 import pandas as pd
-from typing import Sequence
+from typing import Any, Literal, Sequence
 
-n2_binedges: NDArray[np.float64] = np.fromstring(
-    importlib.resources.files("UAVision.bin_edges")
-    .joinpath("opcN2_binedges.txt")
-    .read_text(),
-    sep="\n",
-)
+from UAVision.bins import get_bin_geometry, load_binedges
+from UAVision.profiling import stage
 
-n3_binedges: NDArray[np.float64] = np.fromstring(
-    importlib.resources.files("UAVision.bin_edges")
-    .joinpath("opcN3_binedges.txt")
-    .read_text(),
-    sep="\n",
-)
+logger = logging.getLogger(__name__)
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Load the bundled bin edges on first access of n2_binedges or n3_binedges
+    """
+    if name == "n2_binedges":
+        return load_binedges("opcn2")
+    if name == "n3_binedges":
+        return load_binedges("opcn3")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_OPC_BINS: dict[int, Literal["opcn2", "opcn3"]] = {16: "opcn2", 24: "opcn3"}
+
+
+def calculate_concentration_array(
+    counts: NDArray[Any],
+    instrument: Literal["opcn2", "opcn3"] | None = None,
+    flow: NDArray[np.float64] | float | None = None,
+    period: NDArray[np.float64] | float | None = None,
+    out: NDArray[np.float64] | None = None,
+) -> NDArray[np.float64]:
+    """
+    Concentration and dN/dLogDp of OPC N2 and N3 bin counts on arrays, rows of
+    many flights or sensors can be stacked in one call
+    counts: array of shape (..., bins), e.g. (sensors, rows, 24), bins last
+    instrument: 'opcn2' or 'opcn3', default from the number of bins (16 or 24)
+    flow: optional flow rate of each row, shape counts.shape[:-1] or
+          broadcastable (same unit as in the logs, divided by 100)
+    period: optional sampling period of each row, as flow
+    out: optional float64 array of shape (2, *counts.shape) to write to,
+         counts may be out[0] to compute in place
+    return: array of shape (2, *counts.shape), [0] concentration (counts
+            divided by flow / 100 and period / 100, counts unchanged without
+            flow and period), [1] dN/dLogDp (concentration divided by dlogDp)
+    """
+    counts = np.asarray(counts)
+    if instrument is None:
+        if counts.shape[-1] not in _OPC_BINS:
+            raise ValueError(
+                "counts must have 16 (OPC-N2) or 24 (OPC-N3) bins, "
+                f"got {counts.shape[-1]}"
+            )
+        instrument = _OPC_BINS[counts.shape[-1]]
+    dlog_bin = get_bin_geometry(instrument).dlog_bin
+    if counts.shape[-1] != len(dlog_bin):
+        raise ValueError(
+            f"{instrument} has {len(dlog_bin)} bins, counts have {counts.shape[-1]}"
+        )
+    if (flow is None) != (period is None):
+        raise ValueError("flow and period must be given together")
+    if out is None:
+        out = np.empty((2, *counts.shape), dtype=np.float64)
+    elif out.shape != (2, *counts.shape):
+        raise ValueError(f"out must have shape {(2, *counts.shape)}, got {out.shape}")
+    with stage("mavic.calculate_concentration_array", counts.size // len(dlog_bin)):
+        if flow is None:
+            # counts given as out[0] are already in place, partly overlapping
+            # arrays are copied by copyto as if through a buffer
+            same = (
+                counts.dtype == out.dtype
+                and counts.strides == out[0].strides
+                and counts.ctypes.data == out[0].ctypes.data
+            )
+            if not same:
+                np.copyto(out[0], counts)
+        else:
+            volume = np.asarray(flow, dtype=np.float64) / 100
+            seconds = np.asarray(period, dtype=np.float64) / 100
+            np.divide(counts, volume[..., None], out=out[0])
+            np.divide(out[0], seconds[..., None], out=out[0])
+        np.divide(out[0], dlog_bin, out=out[1])
+    return out
 
 
 def calculate_concentration(
@@ -27,7 +92,8 @@ def calculate_concentration(
     period_label: str | None = None,
 ) -> pd.DataFrame | tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Calculate dN/dLogDp from OPC N2 and N3
+    Calculate dN/dLogDp from OPC N2 and N3, see calculate_concentration_array
+    for many sensors at once
     df: dataframe containing bin counts and flow rate
     bin_label: list of bin column names (string)
     flow_label: flow rate column name (string), only for OPC N3
@@ -35,28 +101,86 @@ def calculate_concentration(
     return: dN/dLogDp dataframe for OPC N2
             concentration and dN/dLogDp dataframe for OPC N3
     """
-    if len(bin_label) == 16:
-        print("OPC-N2")
-        dlog_bin = np.log10(n2_binedges[1:]) - np.log10(n2_binedges[:-1])
-        dndlogdp = df[bin_label].div(dlog_bin, axis=1)
-        return dndlogdp
-
-    elif len(bin_label) == 24:
-        print("OPC-N3")
-        dlog_bin = np.log10(n3_binedges[1:]) - np.log10(n3_binedges[:-1])
-        total_volume = df[flow_label] / 100
-        period = df[period_label] / 100
-        concentration = df[bin_label].div(total_volume, axis=0).div(period, axis=0)
-        dndlogdp = concentration.div(dlog_bin, axis=1)
-        return concentration, dndlogdp
-
-    else:
+    if len(bin_label) not in _OPC_BINS:
         raise ValueError(
             f"bin_label must have 16 (OPC-N2) or 24 (OPC-N3) columns, got {len(bin_label)}"
         )
+    instrument = _OPC_BINS[len(bin_label)]
+    logger.debug("OPC-%s", instrument[-2:].upper())
+    columns = list(bin_label)
+    counts = df[columns].to_numpy()
+    with stage("mavic.calculate_concentration", len(df)):
+        if instrument == "opcn2":
+            result = calculate_concentration_array(counts, instrument)
+            return pd.DataFrame(result[1], index=df.index, columns=columns, copy=False)
+        result = calculate_concentration_array(
+            counts,
+            instrument,
+            df[flow_label].to_numpy(dtype=np.float64),
+            df[period_label].to_numpy(dtype=np.float64),
+        )
+        concentration, dndlogdp = (
+            pd.DataFrame(x, index=df.index, columns=columns, copy=False) for x in result
+        )
+    return concentration, dndlogdp
 
 
-def calculate_lag(df: pd.DataFrame, var1: str, var2: str, lag: int) -> int:
+def _lag_correlations(
+    x: NDArray[np.float64], ys: Sequence[NDArray[np.float64]], lag: int
+) -> NDArray[np.float64]:
+    """
+    Pearson correlation of x with each y shifted forward by -lag..lag, using only
+    pairs where both are valid (as pandas Series.corr), computed with FFT
+    cross-correlations of the masked sums in O(N log N)
+    x: reference array
+    ys: arrays of the same length as x
+    lag: maximum lag (int)
+    return: correlation array (len(ys), 2 * lag + 1)
+    """
+    n = x.size
+    nfft = 1 << int(np.ceil(np.log2(max(n + lag + 1, 2))))
+    index = np.arange(-lag, lag + 1) % nfft
+
+    def spectrum(v: NDArray[np.float64]) -> tuple[NDArray[np.complex128], ...]:
+        valid = ~np.isnan(v)
+        # centering does not change the correlation but limits round-off
+        v0 = np.where(valid, v - v[valid].mean() if valid.any() else 0, 0)
+        return (
+            np.fft.rfft(valid.astype(float), nfft),
+            np.fft.rfft(v0, nfft),
+            np.fft.rfft(v0**2, nfft),
+        )
+
+    def xcorr(
+        a: NDArray[np.complex128], b: NDArray[np.complex128]
+    ) -> NDArray[np.float64]:
+        # sum over t of a[t] * b[t - k] for k in -lag..lag
+        return np.fft.irfft(a * np.conj(b), nfft)[index]
+
+    mx, fx, fxx = spectrum(np.asarray(x, dtype=float))
+    corr = np.empty((len(ys), 2 * lag + 1))
+    for i, y in enumerate(ys):
+        my, fy, fyy = spectrum(np.asarray(y, dtype=float))
+        count = np.rint(xcorr(mx, my))
+        sx = xcorr(fx, my)
+        sy = xcorr(mx, fy)
+        sxx = xcorr(fxx, my)
+        syy = xcorr(mx, fyy)
+        sxy = xcorr(fx, fy)
+        cov = count * sxy - sx * sy
+        var = (count * sxx - sx**2) * (count * syy - sy**2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr[i] = np.where((count > 1) & (var > 0), cov / np.sqrt(var), np.nan)
+    return np.clip(corr, -1, 1)
+
+
+def calculate_lag(
+    df: pd.DataFrame,
+    var1: str,
+    var2: str,
+    lag: int,
+    method: Literal["direct", "fft"] = "direct",
+) -> int:
     """
     Calculate the lag between two variables, same dataframe.
     Please resample the dataframe so spacing is consistent
@@ -64,8 +188,12 @@ def calculate_lag(df: pd.DataFrame, var1: str, var2: str, lag: int) -> int:
     var1: first variable column name (string)
     var2: second variable column name (string)
     lag: maximum lag to consider (int)
+    method: 'direct' computes Series.corr for every lag,
+            'fft' computes all lags at once in O(N log N), same result
     return: lag value at maximum correlation (int)
     """
+    if method == "fft":
+        return calculate_lag_batch(df, var1, [var2], lag)[var2]
     lag_range = np.arange(-lag, lag + 1)
     df_corr = pd.DataFrame(
         {
@@ -78,5 +206,32 @@ def calculate_lag(df: pd.DataFrame, var1: str, var2: str, lag: int) -> int:
     df_corr["covariance"] = df_corr["covariance"].abs()
     imax = df_corr["covariance"].idxmax()
     lag_max = df_corr["lag"][imax]
-    print(f"Max correlation when shift forward {var2} by {lag_max} units")
+    logger.info("Max correlation when shift forward %s by %s units", var2, lag_max)
     return lag_max
+
+
+def calculate_lag_batch(
+    df: pd.DataFrame, ref: str, variables: Sequence[str], lag: int
+) -> dict[str, int]:
+    """
+    Calculate the lag between a reference and many variables, same dataframe,
+    with the FFT method of calculate_lag.
+    Please resample the dataframe so spacing is consistent
+    df: dataframe containing the variables
+    ref: reference variable column name (string), var1 of calculate_lag
+    variables: variable column names (list of string), var2 of calculate_lag
+    lag: maximum lag to consider (int)
+    return: dict of variable name and lag value at maximum correlation
+    """
+    lag_range = np.arange(-lag, lag + 1)
+    corr = _lag_correlations(
+        df[ref].to_numpy(dtype=float),
+        [df[x].to_numpy(dtype=float) for x in variables],
+        lag,
+    )
+    lags = {}
+    for var, corr_ in zip(variables, np.abs(corr), strict=True):
+        lag_max = int(lag_range[np.nanargmax(corr_)])
+        logger.info("Max correlation when shift forward %s by %s units", var, lag_max)
+        lags[var] = lag_max
+    return lags
@@ -1,68 +1,239 @@
-import importlib.resources
-import json
+import logging
 import numpy as np
 import pandas as pd
-import re
 from numpy.typing import NDArray
 from os import PathLike
-from typing import Sequence
+from typing import Any, Iterator, Literal, Sequence
 
-mcda_midbin_all: dict[str, list[float]] = json.loads(
-    importlib.resources.files("UAVision.bin_edges")
-    .joinpath("mcda_midbin_all.txt")
-    .read_text()
-)
+from UAVision.bins import BinGeometry, get_bin_geometry, load_mcda_midbin_all
+from UAVision.profiling import iter_stage, stage
 
+logger = logging.getLogger(__name__)
 
-def preprocess_mcda(
-    file: str | PathLike[str], size: str | Sequence[float] | NDArray[np.float64]
-) -> pd.DataFrame:
+
+def __getattr__(name: str) -> Any:
     """
-    mCDA processing, calculate derived parameters as well
-    file: path to mcda csv file (string)
-    size: size category string, one of the following
-      ['PSL_0.6-40', 'PSL_0.15-17', 'water_0.6-40', 'water_0.15-17'] OR
-      an array-like of mid-bin values (list/tuple/ndarray)
-      If an array-like is provided, it must be length 256.
-    return: processed dataframe
+    Load the bundled mid-bin table on first access of mcda_midbin_all
     """
-    # accept an array-like of mid_bin values as well as a size key string
-    if isinstance(size, (list, tuple, np.ndarray, pd.Series)):
-        mid_bin = np.asarray(size, dtype=float)
-        if mid_bin.ndim != 1 or mid_bin.size != 256:
+    if name == "mcda_midbin_all":
+        return load_mcda_midbin_all()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# lookup table from character code to hex digit value,
+# -1 marks the NUL padding of fixed-width strings, 16 marks an invalid character
+_HEX_LUT = np.full(256, 16, dtype=np.int8)
+_HEX_LUT[0] = -1
+for _i, _c in enumerate("0123456789abcdef"):
+    _HEX_LUT[ord(_c)] = _i
+    _HEX_LUT[ord(_c.upper())] = _i
+
+
+# width of the bytes a cell is decoded from, wider cells fall back to unicode
+_BYTES_WIDTH = 10
+
+
+def _as_fixed_bytes(arr: NDArray[Any]) -> NDArray[Any]:
+    """
+    Convert an object array of str (as pandas returns it) to fixed-width bytes,
+    which is ~3x cheaper than to unicode and a quarter of the size
+    arr: object array of hex strings
+    return: S array, or U array if a cell is not ascii or does not fit
+    """
+    try:
+        fixed = arr.astype(f"S{_BYTES_WIDTH}")
+    except UnicodeEncodeError:
+        return arr.astype(str)
+    # a byte in the last position means the cell may have been truncated
+    last = fixed.reshape(-1).view(np.uint8)[_BYTES_WIDTH - 1 :: _BYTES_WIDTH]
+    if last.any():
+        return arr.astype(str)
+    return fixed
+
+
+def _char_codes(arr: NDArray[Any]) -> NDArray[Any]:
+    """
+    Character codes of a flat S or U array, one row per cell, clipped to 0-255
+    """
+    if arr.dtype.kind == "S":
+        # drop the padding no cell reaches, as the U itemsize would
+        width = max(int(np.char.str_len(arr).max()), 1)
+        return arr.view(np.uint8).reshape(arr.size, -1)[:, :width]
+    return np.minimum(arr.view(np.uint32).reshape(arr.size, -1), 255)
+
+
+def _as_str(value: str | bytes) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def decode_hex_counts(
+    values: NDArray[np.str_] | NDArray[np.object_] | Sequence[str],
+    errors: Literal["raise", "coerce"] = "raise",
+) -> NDArray[np.uint32]:
+    """
+    Decode hex encoded bin counts to integers in one vectorized pass
+    values: array-like of hex strings (any shape), e.g. the 256 mcda bin columns
+    errors: 'raise' to raise ValueError on malformed or empty cells (same as int(x, 16)),
+            'coerce' to set them to 0
+    return: uint32 array with the same shape as values
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind not in "SU":
+        arr = _as_fixed_bytes(arr)
+    shape = arr.shape
+    if arr.size == 0:
+        return np.zeros(shape, dtype=np.uint32)
+    arr = arr.reshape(-1)
+    if arr.dtype.itemsize == 0:
+        arr = arr.astype(arr.dtype.kind + "1")
+    codes = _char_codes(arr)
+    if (codes == ord(" ")).any() or (codes == ord("\t")).any():
+        # int() ignores surrounding whitespace
+        arr = np.char.strip(arr)
+        if arr.dtype.itemsize == 0:
+            arr = arr.astype(arr.dtype.kind + "1")
+        codes = _char_codes(arr)
+
+    # one row per character position, so each pass below is contiguous
+    digits = _HEX_LUT[codes.T]
+    # strings are NUL padded at the end, so a leading pad means an empty cell
+    bad = None
+    if (digits == 16).any() or (digits[0] == -1).any():
+        bad = (digits == 16).any(axis=0) | (digits[0] == -1)
+    if digits.shape[0] > 8:
+        n_digits = (digits >= 0).sum(axis=0)
+        nonzero = digits > 0
+        first_nonzero = np.where(
+            nonzero.any(axis=0), np.argmax(nonzero, axis=0), n_digits
+        )
+        too_long = n_digits - first_nonzero > 8
+        bad = too_long if bad is None else bad | too_long
+    if bad is not None and bad.any():
+        if errors == "raise":
             raise ValueError(
-                "When providing an array-like 'size', it must be one-dimensional with length 256."
-            )
-    elif isinstance(size, str):
-        if size not in mcda_midbin_all:
-            raise KeyError(
-                f"size '{size}' not found. Valid keys: {list(mcda_midbin_all.keys())}"
+                f"invalid literal for uint32 with base 16: {_as_str(arr[bad][0])!r}"
             )
-        mid_bin = np.array(mcda_midbin_all[size], dtype=float)
+        digits[:, bad] = 0
+
+    # Horner scheme over character positions, skipping the trailing padding
+    counts = np.zeros(arr.size, dtype=np.uint32)
+    shifted = np.empty_like(counts)
+    for d in digits:
+        np.left_shift(counts, 4, out=shifted)
+        np.bitwise_or(shifted, d, out=shifted, casting="unsafe")
+        np.copyto(counts, shifted, where=d >= 0)
+    return counts.reshape(shape)
+
+
+def mcda_moments(
+    counts: NDArray[np.integer] | NDArray[np.floating],
+    mid_bin: NDArray[np.float64] | BinGeometry,
+    blocksize: int = 4096,
+    dtype: type[np.floating] = np.float64,
+) -> dict[str, NDArray[np.floating]]:
+    """
+    Calculate mcda derived parameters from raw bin counts, one row block at a time
+    counts: raw bin count matrix (rows x 256), e.g. from decode_hex_counts
+    mid_bin: mid-bin array (um) or a BinGeometry from get_bin_geometry('mcda', size)
+    blocksize: number of rows per block, temporaries are at most blocksize x 256
+    dtype: float type of the calculation and output, np.float32 halves the
+           memory traffic, np.float64 (default) reproduces preprocess_mcda
+    return: dict of arrays 'And_mcda (cm-3)', 'LWC_mcda (g/m3)',
+            'MVD_mcda (um)' and 'ED_mcda (um)'
+    """
+    n_rows, n_bins = counts.shape
+    if isinstance(mid_bin, BinGeometry):
+        mid_bin2 = mid_bin.d2.astype(dtype, copy=False)
+        mid_bin3 = mid_bin.d3.astype(dtype, copy=False)
+        mid_bin = mid_bin.midbin.astype(dtype, copy=False)
     else:
-        raise TypeError(
-            "size must be a key string or an array-like of 256 mid-bin values"
+        mid_bin = np.asarray(mid_bin, dtype=dtype)
+        mid_bin2 = mid_bin**2
+        mid_bin3 = mid_bin**3
+    volume = (mid_bin * 1e-6) ** 3
+    And = np.empty(n_rows, dtype=dtype)
+    lwc = np.empty(n_rows, dtype=dtype)
+    mvd = np.empty(n_rows, dtype=dtype)
+    ed = np.empty(n_rows, dtype=dtype)
+
+    blocksize = max(1, min(blocksize, n_rows))
+    # column-major blocks, so row sums accumulate bin by bin, vectorized over rows
+    bins = np.empty((blocksize, n_bins), dtype=dtype, order="F")
+    conc = np.empty_like(bins)
+    work = np.empty_like(bins)
+    for start in range(0, n_rows, blocksize):
+        stop = min(start + blocksize, n_rows)
+        n = stop - start
+        b, c, w = bins[:n], conc[:n], work[:n]
+        b[...] = counts[start:stop]
+        # Calculate CDNC
+        And[start:stop] = b.sum(axis=1) / 10 / 46.67
+        # concentration per bin, 10s averaged, 2.8L/min flow
+        np.divide(b, 10, out=c)
+        np.divide(c, 2.8e-3 / 60, out=c)
+        # Calculate ED
+        np.multiply(c, mid_bin3, out=w)
+        top = w.sum(axis=1)
+        np.multiply(c, mid_bin2, out=w)
+        bottom = w.sum(axis=1)
+        ed[start:stop] = np.divide(
+            top, bottom, out=np.zeros_like(top), where=bottom != 0
         )
+        # Calculate LWC
+        np.multiply(c, 1e6, out=w)
+        w *= np.pi
+        w /= 6
+        w *= volume
+        lwc_sum = w.sum(axis=1)
+        lwc[start:stop] = lwc_sum
+        # Calculate MVD
+        np.divide(w, lwc_sum[:, np.newaxis], out=w, where=lwc_sum[:, np.newaxis] != 0)
+        w[lwc_sum == 0] = 0
+        np.cumsum(w, axis=1, out=w)
+        w[b == 0] = np.nan
+        # find imin and imax, they contain the point where cumsum of lwc == 0.5
+        imax = np.argmax(w > 0.5, axis=1)
+        imin = n_bins - np.argmax(w[:, ::-1] < 0.5, axis=1) - 1
+        # The MVD formula is based on this where max is first non-zero bin cumsum > 0.5
+        # and min is last non-zero bin cumsum < 0.5
+        # (0.5 - cum_min) / (cum_max - cum_min) = (bx - bmin) / (bmax - bmin)
+        rows = np.arange(n)
+        cum_min = w[rows, imin]
+        cum_max = w[rows, imax]
+        bmin = mid_bin[imin]
+        bmax = mid_bin[imax]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mvd[start:stop] = bmin + (0.5 - cum_min) / (cum_max - cum_min) * (
+                bmax - bmin
+            )
+    return {
+        "And_mcda (cm-3)": And,
+        "LWC_mcda (g/m3)": lwc,
+        "MVD_mcda (um)": mvd,
+        "ED_mcda (um)": ed,
+    }
 
-    # calculate size dlog_bin
-    print(size)
-    binedges = np.append(
-        np.append(
-            mid_bin[0] - (-mid_bin[0] + mid_bin[1]) / 2,
-            (mid_bin[:-1] + mid_bin[1:]) / 2,
-        ),
-        (mid_bin[-1] - mid_bin[-2]) / 2 + mid_bin[-1],
-    )
-    dlog_bin = np.log10(binedges[1:]) - np.log10(binedges[:-1])
 
-    # Load file
-    df = pd.read_csv(file, skiprows=1, header=None, dtype=str)
+def _process_mcda_frame(
+    df: pd.DataFrame,
+    geometry: BinGeometry,
+    compact: bool = False,
+    include_dndlog: bool = True,
+) -> pd.DataFrame:
+    """
+    Process a block of raw mcda rows, as read with header=None and dtype=str
+    df: raw dataframe block
+    geometry: bin geometry of the size setting
+    compact: bool, if True derived values are computed in float64 and stored
+             as float32
+    include_dndlog: bool, if True add the dN/dlogDp columns
+    return: processed dataframe block
+    """
+    dtype = np.float32 if compact else np.float64
     col_indices = list(range(257)) + list(range(df.shape[1] - 6, df.shape[1]))
     df = df.iloc[:, col_indices]
     df = df.dropna(axis=0)
-    df = df.reset_index(drop=True)
-    df.columns = np.arange(df.columns.size)
-    df[0] = pd.to_datetime(df[0], format="%Y%m%d%H%M%S")
+    index = pd.RangeIndex(len(df))
 
     dndlog_label = ["bin" + str(x) + "_mcda (dN/dlogDp)" for x in range(1, 257)]
     conc_label = ["bin" + str(x) + "_mcda (cm-3)" for x in range(1, 257)]
@@ -74,68 +245,236 @@ def preprocess_mcda(
         "pm10_mcda",
         "pmtot_mcda",
     ]
-    df.columns = np.r_[["datetime"], conc_label, pm_label]
-
-    # Convert hex to int
-    df[conc_label] = df[conc_label].map(lambda x: int(x, base=16))
-    # Convert to float
-    df = df.set_index("datetime").astype("float").reset_index()
-    # Bin counts
-    df_bins = df[conc_label].copy().to_numpy().astype(float)
-    # Calculate concentration cm-3
-    df[conc_label] = (
-        df[conc_label] / 10 / 46.67
-    )  # 10s averaged, 2.8L/min flow = 46.67 ccm/s
-
-    # Calculate dN/dlogDp
-    dndlog = df[conc_label] / dlog_bin
-    dndlog.columns = dndlog_label
-    df = pd.concat([df, dndlog], axis=1)
-    # Calculate CDNC
-    df["And_mcda (cm-3)"] = df_bins.sum(axis=1) / 10 / 46.67
-    # Calculate LWC
-    conc_perbin = df_bins / 10 / (2.8e-3 / 60)
-    lwc_perbin = conc_perbin * 1e6 * np.pi / 6 * (mid_bin * 1e-6) ** 3
-    lwc_sum = lwc_perbin.sum(axis=1)
-    df["LWC_mcda (g/m3)"] = lwc_sum
-    # Calculate MVD
-    p_lwc_perbin = np.divide(
-        lwc_perbin,
-        lwc_sum[:, np.newaxis],
-        out=np.zeros_like(lwc_perbin),
-        where=lwc_sum[:, np.newaxis] != 0,
-    )
-    cumsum_lwc_perbin = p_lwc_perbin.cumsum(axis=1)
-    cumsum_lwc_perbin[df_bins == 0] = np.nan
-    # find imin and imax, they contain the point where cumsum_lwc_perbin == 0.5
-    imax = np.argmax((cumsum_lwc_perbin > 0.5), axis=1)
-    imin = (
-        cumsum_lwc_perbin.shape[1]
-        - np.argmax(cumsum_lwc_perbin[:, ::-1] < 0.5, axis=1)
-        - 1
-    )
-    # The MVD formula is based on this where max is first non-zero bin cumsum > 0.5 and
-    # min is last non-zero bin cumsum < 0.5
-    # (0.5 - cum_min) / (cum_max - cum_min) = (bx - bmin) / (bmax - bmin)
-    cum_min = cumsum_lwc_perbin[np.arange(len(cumsum_lwc_perbin)), imin]
-    cum_max = cumsum_lwc_perbin[np.arange(len(cumsum_lwc_perbin)), imax]
-    bmin = mid_bin[imin]
-    bmax = mid_bin[imax]
-    df["MVD_mcda (um)"] = bmin + (0.5 - cum_min) / (cum_max - cum_min) * (bmax - bmin)
-    # Calculate ED
-    top = (conc_perbin * mid_bin**3).sum(axis=1)
-    bottom = (conc_perbin * mid_bin**2).sum(axis=1)
-    df["ED_mcda (um)"] = np.divide(
-        top, bottom, out=np.zeros_like(top), where=bottom != 0
-    )
-    # Drop columns
-    df = df.drop(["pcount_mcda", "pm4_mcda", "pmtot_mcda"], axis=1)
+    with stage("mcda.datetime", len(df)):
+        datetime = pd.to_datetime(df.iloc[:, 0], format="%Y%m%d%H%M%S")
+    with stage("mcda.hex_decode", len(df)):
+        # Convert hex to int, bin counts
+        counts = decode_hex_counts(df.iloc[:, 1:257].to_numpy())
+    pm = df.iloc[:, 257:].astype(dtype)
+    pm.columns = pm_label
+    pm.index = index
+    with stage("mcda.concentration", len(df)):
+        # Calculate concentration cm-3
+        conc = counts / 10 / 46.67  # 10s averaged, 2.8L/min flow = 46.67 ccm/s
+        # Calculate dN/dlogDp
+        if include_dndlog:
+            dndlog = (conc / geometry.dlog_bin).astype(dtype, copy=False)
+        conc = conc.astype(dtype, copy=False)
+    with stage("mcda.moments", len(df)):
+        moments = {
+            k: v.astype(dtype, copy=False)
+            for k, v in mcda_moments(counts, geometry).items()
+        }
+
+    with stage("mcda.assemble", len(df)):
+        blocks = [
+            pd.DataFrame({"datetime": datetime.to_numpy()}, index=index),
+            pd.DataFrame(conc, columns=conc_label, index=index),
+            pm,
+        ]
+        if include_dndlog:
+            blocks.append(pd.DataFrame(dndlog, columns=dndlog_label, index=index))
+        blocks.append(pd.DataFrame(moments, index=index))
+        df = pd.concat(blocks, axis=1)
+        # Drop columns
+        df = df.drop(["pcount_mcda", "pm4_mcda", "pmtot_mcda"], axis=1)
     return df
 
 
+def preprocess_mcda(
+    file: str | PathLike[str],
+    size: str | Sequence[float] | NDArray[np.float64],
+    compact: bool = False,
+    include_dndlog: bool = True,
+) -> pd.DataFrame:
+    """
+    mCDA processing, calculate derived parameters as well
+    file: path to mcda csv file (string)
+    size: size category string, one of the following
+      ['PSL_0.6-40', 'PSL_0.15-17', 'water_0.6-40', 'water_0.15-17'] OR
+      an array-like of mid-bin values (list/tuple/ndarray)
+      If an array-like is provided, it must be length 256.
+    compact: bool, if True derived values are computed in float64 and stored
+             as float32, relative error at most UAVision.utils.FLOAT32_RTOL.
+             The float64 blocks still exist while processing, so only the
+             returned dataframe is smaller (default False)
+    include_dndlog: bool, if False leave out the 256 dN/dlogDp columns, they
+                    can be computed when needed with dndlog_mcda (default True)
+    return: processed dataframe
+    """
+    geometry = get_bin_geometry("mcda", size)
+    logger.info("mcda size %s", size)
+
+    with stage("mcda.preprocess_mcda") as total:
+        # Load file
+        with stage("mcda.read_csv") as s:
+            df = pd.read_csv(file, skiprows=1, header=None, dtype=str)
+            s.rows = len(df)
+        df = _process_mcda_frame(df, geometry, compact, include_dndlog)
+        total.rows = len(df)
+    return df
+
+
+def iter_preprocess_mcda(
+    file: str | PathLike[str],
+    size: str | Sequence[float] | NDArray[np.float64],
+    chunksize: int = 10000,
+    compact: bool = False,
+    include_dndlog: bool = True,
+) -> Iterator[pd.DataFrame]:
+    """
+    mCDA processing in blocks of rows, memory use depends on chunksize only
+    file: path to mcda csv file (string)
+    size: size category string or an array-like of 256 mid-bin values,
+          see preprocess_mcda
+    chunksize: number of raw rows per block (int)
+    compact, include_dndlog: see preprocess_mcda
+    return: iterator of processed dataframe blocks, their concatenation
+            equals the output of preprocess_mcda
+    """
+    geometry = get_bin_geometry("mcda", size)
+
+    start = 0
+    with pd.read_csv(
+        file, skiprows=1, header=None, dtype=str, chunksize=chunksize
+    ) as reader:
+        for chunk in iter_stage(reader, "mcda.read_csv"):
+            df = _process_mcda_frame(chunk, geometry, compact, include_dndlog)
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
+
+
+def preprocess_mcda_to_csv(
+    file: str | PathLike[str],
+    size: str | Sequence[float] | NDArray[np.float64],
+    file_out: str | PathLike[str],
+    chunksize: int = 10000,
+) -> int:
+    """
+    mCDA processing written to csv one block at a time, with bounded memory
+    file: path to mcda csv file (string)
+    size: size category string or an array-like of 256 mid-bin values,
+          see preprocess_mcda
+    file_out: path to output csv file (string)
+    chunksize: number of raw rows per block (int)
+    return: number of rows written
+    """
+    n_rows = 0
+    for df in iter_preprocess_mcda(file, size, chunksize=chunksize):
+        with stage("mcda.write_csv", len(df)):
+            df.to_csv(
+                file_out,
+                mode="w" if n_rows == 0 else "a",
+                header=n_rows == 0,
+                index=False,
+            )
+        n_rows += len(df)
+    return n_rows
+
+
+def dndlog_mcda(
+    df: pd.DataFrame, size: str | Sequence[float] | NDArray[np.float64]
+) -> pd.DataFrame:
+    """
+    dN/dlogDp of processed mcda data, e.g. of preprocess_mcda(include_dndlog=False)
+    df: dataframe with the bin1_mcda (cm-3) ... bin256_mcda (cm-3) columns
+    size: size category string or an array-like of 256 mid-bin values,
+          see preprocess_mcda
+    return: dataframe of the bin1_mcda (dN/dlogDp) ... columns, same index,
+            float32 when the concentrations are float32, then with a relative
+            error to the float64 values of at most about 2 * FLOAT32_RTOL
+    """
+    geometry = get_bin_geometry("mcda", size)
+    conc_label = ["bin" + str(x) + "_mcda (cm-3)" for x in range(1, 257)]
+    dndlog_label = ["bin" + str(x) + "_mcda (dN/dlogDp)" for x in range(1, 257)]
+    conc = df[conc_label].to_numpy()
+    dndlog = conc.astype(np.float64, copy=False) / geometry.dlog_bin
+    return pd.DataFrame(
+        dndlog.astype(conc.dtype, copy=False), columns=dndlog_label, index=df.index
+    )
+
+
+# size setting of the mcda changed on this date
+SIZE_CHANGEOVER = np.datetime64("2022-10-03")
+
+
+def _cloud_bin_sums(
+    conc: NDArray[np.float64], first_bin: NDArray[np.intp]
+) -> NDArray[np.float64]:
+    """
+    Row sums of conc from first_bin of each row to the last bin, computed on
+    contiguous runs of rows sharing first_bin
+    """
+    sums = np.empty(conc.shape[0], dtype=np.float64)
+    runs = np.flatnonzero(first_bin[1:] != first_bin[:-1]) + 1
+    if runs.size < 64:
+        starts = np.concatenate(([0], runs))
+        ends = np.concatenate((runs, [conc.shape[0]]))
+        for a, b in zip(starts, ends):
+            sums[a:b] = conc[a:b, first_bin[a] :].sum(axis=1)
+    else:
+        for k in np.unique(first_bin):
+            rows = first_bin == k
+            sums[rows] = conc[rows, k:].sum(axis=1)
+    # missing bins are skipped, as in a pandas sum
+    missing = np.flatnonzero(np.isnan(sums))
+    for row in missing:
+        sums[row] = np.nansum(conc[row, first_bin[row] :])
+    return sums
+
+
+def cloudmask_array(
+    conc: NDArray[np.float64],
+    datetime: NDArray[np.datetime64] | pd.Series,
+    rh: NDArray[np.float64] | pd.Series,
+    size: str | Sequence[float] | NDArray[np.float64] | None = None,
+    rh_threshold: float = 80,
+    count_threshold: float = 5,
+    diameter: float = 2,
+    start: int = 81,
+) -> NDArray[np.bool_]:
+    """
+    Cloud mask for mcda on arrays, rows of many flights can be masked at once
+    conc: (n, 256) array of bin concentrations (cm-3), the bin*_mcda (cm-3)
+          columns of preprocess_mcda
+    datetime: n datetimes, used to choose the size setting when size is None
+    rh: n relative humidities (%)
+    size: None to use water_0.15-17 before 2022-10-03 and water_0.6-40 after
+          for each row, or a size key string / array-like of 256 mid-bin values
+          used for all rows
+    rh_threshold: cloud when rh above this (%) (default 80)
+    count_threshold: cloud when the 10 s count of the large bins is above
+                     this (default 5)
+    diameter: large bins threshold diameter (um) (default 2)
+    start: first bin considered when searching the threshold bin, the index
+           found is applied from the first bin as in cloudmask (default 81)
+    return: boolean array, True for cloud
+    """
+    conc = np.asarray(conc, dtype=np.float64)
+    if size is None:
+        after = np.asarray(datetime, dtype="datetime64[ns]") >= SIZE_CHANGEOVER
+        first_bin = np.where(
+            after,
+            get_bin_geometry("mcda", "water_0.6-40").threshold_index(diameter, start),
+            get_bin_geometry("mcda", "water_0.15-17").threshold_index(diameter, start),
+        )
+    else:
+        first_bin = np.full(
+            conc.shape[0],
+            get_bin_geometry("mcda", size).threshold_index(diameter, start),
+        )
+    if conc.shape[0] == 0:
+        return np.zeros(0, dtype=bool)
+    rh_cloud = np.asarray(rh, dtype=np.float64) > rh_threshold
+    count_cloud = _cloud_bin_sums(conc, first_bin) * 10 > count_threshold
+    return rh_cloud & count_cloud
+
+
 def cloudmask(df: pd.DataFrame) -> pd.Series:
     """
-    Cloud mask for mcda
+    Cloud mask for mcda, the size setting is chosen from the date of the first row,
+    see cloudmask_array for rows spanning the size change and other thresholds
     df: dataframe with mcda and BME sensor data
     return: boolean Series indicating cloud presence
     """
@@ -143,14 +482,12 @@ def cloudmask(df: pd.DataFrame) -> pd.Series:
         size = "water_0.15-17"
     else:
         size = "water_0.6-40"
-    cda_midbin = np.array(mcda_midbin_all[size], dtype=float)
-    cda_midbin = cda_midbin[81:]
-    # RH > 80%
-    rh_cloud = df["rh_bme (%)"] > 80
-    # Count > 1 in 10s with size > 2 um
-    bin_lab = [x for x in df.columns if re.search(r"bin[0-9]+_mcda \(cm-3\)", x)]
-    bin_lab_cloud = bin_lab[np.argmax(cda_midbin > 2) :]
-    bin_count = df[bin_lab]
-    count_cloud = bin_count[bin_lab_cloud].sum(axis=1) * 10 > 5
-    cloudmask = rh_cloud & count_cloud
-    return cloudmask
+    conc_label = ["bin" + str(x) + "_mcda (cm-3)" for x in range(1, 257)]
+    # RH > 80% and count > 5 in 10s with size > 2 um
+    cloudmask = cloudmask_array(
+        df[conc_label].to_numpy(dtype=np.float64),
+        df["datetime"],
+        df["rh_bme (%)"],
+        size=size,
+    )
+    return pd.Series(cloudmask, index=df.index)
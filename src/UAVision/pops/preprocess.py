@@ -3,20 +3,34 @@ import numpy as np
 from numpy.typing import NDArray
 import importlib.resources
 from os import PathLike
-from typing import Sequence
+from typing import Any, Sequence
 
-pops_binedges_string = (
-    importlib.resources.files("UAVision.bin_edges")
-    .joinpath("pops_binedges.txt")
-    .read_text()
-)
-pops_binedges = np.fromstring(pops_binedges_string, sep="\n")
+from UAVision.bins import get_bin_geometry, load_binedges
+from UAVision.profiling import stage
+from UAVision.utils import compact_dtypes, resample_sparse
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Load the bundled bin edges on first access of pops_binedges
+    """
+    if name == "pops_binedges":
+        return load_binedges("pops")
+    if name == "pops_binedges_string":
+        return (
+            importlib.resources.files("UAVision.bin_edges")
+            .joinpath("pops_binedges.txt")
+            .read_text()
+        )
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def preprocess_pops(
     file: str | PathLike[str],
     size: Sequence[float] | NDArray[np.float64] | None = None,
     drop_aux: bool = True,
+    compact: bool = False,
+    include_dndlog: bool = True,
 ) -> pd.DataFrame:
     """
     POPS processing
@@ -25,32 +39,49 @@ def preprocess_pops(
     size: optional. If None uses bundled pops_binedges (bin edges).
           If array-like is provided it must be the bin edges with length 17.
     drop_aux: bool, if True drop auxiliary columns (default True). If False keep them.
+    compact: bool, if True store float columns as float32 once processed in
+             float64, see UAVision.utils.compact_dtypes (default False)
+    include_dndlog: bool, if False leave out the dN/dlogDp columns, they can
+                    be computed when needed with dndlog_pops (default True)
     return: processed dataframe
     """
-    df = pd.read_csv(file)
-    df = df.dropna(axis=0)
-    df = df.reset_index(drop=True)
-    df["datetime"] = pd.to_datetime(df["DateTime"], unit="s")
-    df = df.set_index("datetime").resample("1s").mean().dropna().reset_index()
+    with stage("pops.preprocess_pops") as total:
+        with stage("pops.read_csv") as s:
+            df = pd.read_csv(file)
+            s.rows = len(df)
+        df = df.dropna(axis=0)
+        df = df.reset_index(drop=True)
+        # determine binedges from provided size or bundled pops_binedges
+        dlog_bin = get_bin_geometry("pops", size).dlog_bin
+        df = _process_pops_frame(df, dlog_bin, drop_aux, include_dndlog)
+        if compact:
+            df = compact_dtypes(df)
+        total.rows = len(df)
+    return df
+
+
+def _process_pops_frame(
+    df: pd.DataFrame,
+    dlog_bin: NDArray[np.float64],
+    drop_aux: bool,
+    include_dndlog: bool = True,
+) -> pd.DataFrame:
+    """
+    Process raw pops rows without missing values, averaged to 1 s
+    df: raw dataframe with complete rows
+    dlog_bin: dlogDp of each bin
+    drop_aux: bool, if True drop auxiliary columns
+    include_dndlog: bool, if True add the dN/dlogDp columns
+    return: processed dataframe
+    """
+    with stage("pops.datetime", len(df)):
+        df["datetime"] = pd.to_datetime(df["DateTime"], unit="s")
+    with stage("pops.resample", len(df)):
+        df = resample_sparse(df).dropna().reset_index(drop=True)
     df = df.drop(["DateTime"], axis=1)
     time_col = df.pop("datetime")
     df.insert(0, "datetime", time_col)
 
-    # determine binedges from provided size or bundled pops_binedges
-    if size is None:
-        binedges = pops_binedges.astype(float)
-    elif isinstance(size, (list, tuple, np.ndarray, pd.Series)):
-        arr = np.asarray(size, dtype=float)
-        if arr.ndim != 1 or arr.size != 17:
-            raise ValueError(
-                "When providing 'size' as an array it must be a 1-D array of 17 bin edges."
-            )
-        binedges = arr
-    else:
-        raise TypeError("size must be None or an array-like of 17 bin edges")
-
-    dlog_bin = np.log10(binedges[1:]) - np.log10(binedges[:-1])
-
     pops_binlab = [
         "b0",
         "b1",
@@ -72,12 +103,14 @@ def preprocess_pops(
     dndlog_label = ["bin" + str(x) + "_pops (dN/dlogDp)" for x in range(1, 17)]
     conc_label = ["bin" + str(x) + "_pops (cm-3)" for x in range(1, 17)]
     df = df.rename(columns={x: y for x, y in zip(pops_binlab, conc_label)})
-    # Calculate concentration cm-3
-    df[conc_label] = df[conc_label].div(df[" POPS_Flow"], axis=0)
-    # Calculate dN/dlogDp
-    dndlog = df[conc_label].div(dlog_bin, axis=1)
-    dndlog.columns = dndlog_label
-    df = pd.concat([df, dndlog], axis=1)
+    with stage("pops.concentration", len(df)):
+        # Calculate concentration cm-3
+        df[conc_label] = df[conc_label].div(df[" POPS_Flow"], axis=0)
+        if include_dndlog:
+            # Calculate dN/dlogDp
+            dndlog = df[conc_label].div(dlog_bin, axis=1)
+            dndlog.columns = dndlog_label
+            df = pd.concat([df, dndlog], axis=1)
 
     if drop_aux:
         df = df.drop(
@@ -119,3 +152,25 @@ def preprocess_pops(
         axis=1,
     )
     return df
+
+
+def dndlog_pops(
+    df: pd.DataFrame,
+    size: Sequence[float] | NDArray[np.float64] | None = None,
+) -> pd.DataFrame:
+    """
+    dN/dlogDp of processed pops data, e.g. of preprocess_pops(include_dndlog=False)
+    df: dataframe with the bin1_pops (cm-3) ... bin16_pops (cm-3) columns
+    size: optional bin edges, see preprocess_pops
+    return: dataframe of the bin1_pops (dN/dlogDp) ... columns, same index,
+            float32 when the concentrations are float32, then with a relative
+            error to the float64 values of at most about 2 * FLOAT32_RTOL
+    """
+    dlog_bin = get_bin_geometry("pops", size).dlog_bin
+    conc_label = ["bin" + str(x) + "_pops (cm-3)" for x in range(1, 17)]
+    dndlog_label = ["bin" + str(x) + "_pops (dN/dlogDp)" for x in range(1, 17)]
+    dndlog = df[conc_label].div(dlog_bin, axis=1)
+    dndlog.columns = dndlog_label
+    if (df[conc_label].dtypes == np.float32).all():
+        dndlog = dndlog.astype(np.float32)
+    return dndlog
@@ -0,0 +1,239 @@
+from typing import Any, Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from UAVision.profiling import stage
+
+LEGS = np.array(["ascent", "descent", "all"])
+
+# columns sorted together when computing medians and percentiles, so the
+# sort buffers stay below about 16 M values
+_BLOCK_VALUES = 1 << 24
+
+
+def flight_legs(
+    height: NDArray[np.float64] | pd.Series,
+    flight: NDArray[Any] | pd.Series | None = None,
+) -> NDArray[np.int8]:
+    """
+    Ascent and descent of each row, split at the highest point of each flight,
+    only once per flight
+    height: heights of the rows, in time order within each flight
+    flight: optional flight label of each row, None for one flight
+    return: int8 array, 0 for rows up to the highest point (ascent), 1 after
+            it (descent)
+    """
+    height = np.asarray(height, dtype=np.float64)
+    n = len(height)
+    if n == 0:
+        return np.zeros(0, dtype=np.int8)
+    codes = np.zeros(n, np.intp) if flight is None else pd.factorize(flight)[0]
+    order = np.argsort(codes, kind="stable")
+    h = np.where(np.isnan(height), -np.inf, height)[order]
+    c = codes[order]
+    starts = np.flatnonzero(np.diff(c, prepend=-2))
+    highest = np.maximum.reduceat(h, starts)
+    lengths = np.diff(np.append(starts, n))
+    # first row reaching the highest point of its flight
+    at_top = h == np.repeat(highest, lengths)
+    position = np.where(at_top, np.arange(n), n)
+    apex = np.minimum.reduceat(position, starts)
+    legs = np.empty(n, dtype=np.int8)
+    legs[order] = np.arange(n) > np.repeat(apex, lengths)
+    return legs
+
+
+def height_edges(
+    height: NDArray[np.float64] | pd.Series, layer: float
+) -> NDArray[np.float64]:
+    """
+    Layer edges at multiples of layer covering all heights
+    height: heights
+    layer: layer thickness (m)
+    return: array of edges
+    """
+    height = np.asarray(height, dtype=np.float64)
+    if not np.isfinite(height).any():
+        return np.array([0.0, layer])
+    low = np.floor(np.nanmin(height) / layer)
+    high = np.floor(np.nanmax(height) / layer) + 1
+    return np.arange(low, high + 1) * layer
+
+
+def _lerp(
+    a: NDArray[np.float64], b: NDArray[np.float64], t: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    # interpolation of np.percentile (method 'linear')
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def _sorted_groups(
+    values: NDArray[np.float64], starts: NDArray[np.intp], size: NDArray[np.intp]
+) -> Iterator[tuple[NDArray[np.intp], NDArray[np.float64]]]:
+    # groups of similar size (up to the same power of two) are padded with NaN
+    # to one (groups, rows, columns) array and sorted along the rows together,
+    # missing values last
+    classes = np.ceil(np.log2(np.maximum(size, 1))).astype(np.intp)
+    for c in np.unique(classes):
+        groups = np.flatnonzero(classes == c)
+        offset = np.arange(size[groups].max())
+        inside = offset < size[groups, None]
+        block = values[np.where(inside, starts[groups, None] + offset, 0)]
+        block[~inside] = np.nan
+        yield groups, np.sort(block, axis=1)
+
+
+def _nth(ordered: NDArray[np.float64], k: NDArray[np.intp]) -> NDArray[np.float64]:
+    # k-th value of each group and column of sorted groups
+    return np.take_along_axis(ordered, k[:, None, :], axis=1)[:, 0]
+
+
+def vertical_profile(
+    df: pd.DataFrame,
+    columns: Sequence[str] | None = None,
+    bins: float | Sequence[float] | NDArray[np.float64] = 50.0,
+    height: str = "height_bme (m)",
+    flight: str | None = None,
+    split: bool = True,
+    stats: Sequence[str] = ("count", "mean", "median"),
+    percentiles: Sequence[float] = (),
+) -> dict[str, pd.DataFrame]:
+    """
+    Statistics of columns in height layers, per flight and per ascent and
+    descent. All flights, legs, layers and columns are computed together
+    with one sort of the rows, e.g. the 256 bin*_mcda (cm-3) columns of
+    hundreds of flights in one call
+    df: dataframe with a height column, rows in time order within each
+        flight, e.g. fuse of bme and mcda/pops/cpc products
+    columns: columns to bin, default all numeric columns but height
+    bins: layer thickness (m), layers start at multiples of it, or array of
+          layer edges (default 50.0)
+    height: height column (default 'height_bme (m)')
+    flight: optional column of flight labels, None for one flight
+    split: bool, if True split each flight into ascent and descent at its
+           highest point, see flight_legs, else leg is 'all' (default True).
+           Each flight is split once, so a yo-yo or multi-profile flight gives
+           one ascent up to its highest point and one descent after it, label
+           the single profiles as flights to bin them separately
+    stats: any of 'count' (non-missing values), 'mean' and 'median'
+           (default all three)
+    percentiles: percentiles in [0, 100], as np.nanpercentile with the
+                 linear method, returned as e.g. 'p10' (default none)
+    return: dict of statistic name and dataframe with one row per occupied
+            layer: flight (if given), leg, height_bottom (m), height_top (m)
+            and the columns, NaN where a column has no value in the layer
+    """
+    for x in stats:
+        if x not in ("count", "mean", "median"):
+            raise ValueError(f"stats must be 'count', 'mean' or 'median', got {x!r}")
+    q = np.asarray(percentiles, dtype=np.float64)
+    if ((q < 0) | (q > 100)).any():
+        raise ValueError("percentiles must be in [0, 100]")
+    if columns is None:
+        columns = [
+            x
+            for x in df.columns
+            if x not in (height, flight) and pd.api.types.is_numeric_dtype(df[x])
+        ]
+    columns = list(columns)
+
+    h = df[height].to_numpy(dtype=np.float64)
+    if isinstance(bins, (int, float, np.number)):
+        edges = height_edges(h, float(bins))
+    else:
+        edges = np.asarray(bins, dtype=np.float64)
+    n_layers = len(edges) - 1
+    if n_layers < 1 or (np.diff(edges) <= 0).any():
+        raise ValueError("bins must be a positive thickness or increasing edges")
+    labels = None if flight is None else df[flight].to_numpy()
+    with stage("profiles.group", len(df)):
+        layer = np.searchsorted(edges, h, side="right") - 1
+        # heights on the top edge belong to the top layer
+        layer[h == edges[-1]] = n_layers - 1
+        keep = (layer >= 0) & (layer < n_layers) & ~np.isnan(h)
+        if labels is None:
+            codes = np.zeros(len(df), np.intp)
+            uniques = np.zeros(0)
+        else:
+            codes, uniques = pd.factorize(labels)
+        if split:
+            legs = flight_legs(h, labels).astype(np.intp)
+        else:
+            legs = np.full(len(df), 2, dtype=np.intp)
+        key = (codes * 3 + legs) * n_layers + layer
+        rows = np.flatnonzero(keep & (codes >= 0))
+        rows = rows[np.argsort(key[rows], kind="stable")]
+        key = key[rows]
+        new = np.ones(len(rows), dtype=bool)
+        new[1:] = key[1:] != key[:-1]
+        starts = np.flatnonzero(new)
+        group = key[starts]
+        size = np.diff(np.append(starts, len(rows)))
+
+    out_index: dict[str, Any] = {}
+    if flight is not None:
+        out_index[flight] = uniques[group // (3 * n_layers)]
+    out_index["leg"] = LEGS[group // n_layers % 3]
+    out_index["height_bottom (m)"] = edges[group % n_layers]
+    out_index["height_top (m)"] = edges[group % n_layers + 1]
+
+    names = list(stats) + [f"p{x:g}" for x in q]
+    results: dict[str, dict[str, NDArray[np.float64]]] = {x: {} for x in names}
+    n_groups = len(starts)
+    block = max(1, _BLOCK_VALUES // max(len(rows), 1))
+    for j0 in range(0, len(columns), block):
+        chunk = columns[j0 : j0 + block]
+        with stage("profiles.stats", len(rows)):
+            values = df[chunk].to_numpy(dtype=np.float64)[rows]
+            valid = ~np.isnan(values)
+            if n_groups:
+                count = np.add.reduceat(valid, starts, axis=0, dtype=np.int64)
+            else:
+                count = np.zeros((0, len(chunk)), dtype=np.int64)
+            computed: dict[str, NDArray[np.float64]] = {}
+            if "count" in stats:
+                computed["count"] = count
+            if "mean" in stats:
+                total = (
+                    np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+                    if n_groups
+                    else np.zeros(count.shape)
+                )
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    computed["mean"] = total / count
+            if "median" in stats or len(q):
+                shape = (n_groups, len(chunk))
+                if "median" in stats:
+                    computed["median"] = np.full(shape, np.nan)
+                for x in q:
+                    computed[f"p{x:g}"] = np.full(shape, np.nan)
+                for groups, ordered in _sorted_groups(values, starts, size):
+                    n_valid = count[groups]
+                    last = np.maximum(n_valid - 1, 0)
+                    empty = n_valid == 0
+                    if "median" in stats:
+                        middle = (
+                            _nth(ordered, last // 2) + _nth(ordered, (last + 1) // 2)
+                        ) / 2
+                        computed["median"][groups] = np.where(empty, np.nan, middle)
+                    for x in q:
+                        virtual = last * (x / 100)
+                        below = np.floor(virtual).astype(np.intp)
+                        above = np.minimum(below + 1, last)
+                        value = _lerp(
+                            _nth(ordered, below), _nth(ordered, above), virtual - below
+                        )
+                        computed[f"p{x:g}"][groups] = np.where(empty, np.nan, value)
+        for name, matrix in computed.items():
+            for j, x in enumerate(chunk):
+                results[name][x] = matrix[:, j]
+
+    return {
+        name: pd.DataFrame(
+            {**out_index, **results[name]}, columns=[*out_index, *columns]
+        )
+        for name in names
+    }
@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from os import PathLike
+from typing import Any, Iterable, Iterator, Self, TypeVar
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# UAVISION_PROFILE=1 logs a stage report at exit, any other value is taken as
+# the path of a json report written at exit
+ENV_VAR = "UAVISION_PROFILE"
+
+
+class Profile:
+    """
+    Wall time, rows and peak memory of named stages, see profile
+
+    stages: dict of stage name and its totals: calls, seconds, rows and
+            peak_mb (largest increase of traced memory during one call,
+            None when memory is not traced)
+    """
+
+    def __init__(self, memory: bool = True) -> None:
+        self.memory = memory
+        self.stages: dict[str, dict[str, Any]] = {}
+        # [memory at start, peak seen] of the open stages of each thread
+        self._stacks: dict[int, list[list[int]]] = {}
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list[list[int]]:
+        return self._stacks.setdefault(threading.get_ident(), [])
+
+    def _add(
+        self, name: str, seconds: float, rows: int | None, peak: int | None
+    ) -> None:
+        with self._lock:
+            record = self.stages.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "rows": 0, "peak_mb": None}
+            )
+            record["calls"] += 1
+            record["seconds"] += seconds
+            if rows is not None:
+                record["rows"] += rows
+            if peak is not None:
+                record["peak_mb"] = max(record["peak_mb"] or 0.0, peak / 1e6)
+
+    def report(self) -> dict[str, dict[str, Any]]:
+        """
+        return: dict of stage name and calls, seconds, rows and peak_mb,
+                in the order the stages were first entered
+        """
+        return {x: dict(y) for x, y in self.stages.items()}
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        return: dataframe of the report, one row per stage
+        """
+        return pd.DataFrame.from_dict(
+            self.report(),
+            orient="index",
+            columns=["calls", "seconds", "rows", "peak_mb"],
+        ).rename_axis("stage")
+
+    def to_json(self, path: str | PathLike[str]) -> None:
+        """
+        Write the report as json
+        path: json file (string or PathLike)
+        return: None
+        """
+        with open(path, "w") as fh:
+            json.dump(self.report(), fh, indent=1)
+
+    def __str__(self) -> str:
+        return self.to_frame().to_string()
+
+
+_ACTIVE: ContextVar[Profile | None] = ContextVar("uavision_profile", default=None)
+_GLOBAL: Profile | None = None
+
+
+class stage:
+    """
+    Record a named stage in the active profile, does nothing when no profile
+    is active
+
+    name: stage name, e.g. 'mcda.hex_decode'
+    rows: optional number of rows processed, can also be set on the returned
+          object inside the block
+
+    Usage:
+        with stage("cpc.read_csv") as s:
+            df = pd.read_csv(file)
+            s.rows = len(df)
+    """
+
+    __slots__ = ("_base", "_profile", "_start", "name", "rows")
+
+    def __init__(self, name: str, rows: int | None = None) -> None:
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self) -> Self:
+        profile = _ACTIVE.get() or _GLOBAL
+        self._profile = profile
+        if profile is None:
+            return self
+        if profile.memory and tracemalloc.is_tracing():
+            stack = profile._stack()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # the peak of the enclosing stage so far is kept before resetting
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            stack.append([current, current])
+            self._base = current
+        else:
+            self._base = -1
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        profile = self._profile
+        if profile is None:
+            return
+        seconds = time.perf_counter() - self._start
+        peak = None
+        stack = profile._stack() if self._base >= 0 else None
+        if stack:
+            base, seen = stack.pop()
+            top = max(seen, tracemalloc.get_traced_memory()[1])
+            peak = top - base
+            if stack:
+                stack[-1][1] = max(stack[-1][1], top)
+        profile._add(self.name, seconds, self.rows, peak)
+
+
+T = TypeVar("T")
+
+
+def iter_stage(iterable: Iterable[T], name: str) -> Iterator[T]:
+    """
+    Record getting each item of an iterable as a stage, e.g. reading chunks
+    iterable: iterable of items with a length, such as dataframe chunks
+    name: stage name
+    return: iterator of the same items
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as s:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            s.rows = len(item)  # type: ignore[arg-type]
+        yield item
+
+
+class profile:
+    """
+    Collect the stages run inside the block, in this thread or task
+
+    memory: bool, if True trace memory with tracemalloc to record the peak of
+            each stage, this slows down the run (default True)
+
+    Usage:
+        with profile() as prof:
+            df = preprocess_mcda(file, size)
+        print(prof)  # or prof.report(), prof.to_json(path)
+    """
+
+    def __init__(self, memory: bool = True) -> None:
+        self.memory = memory
+
+    def __enter__(self) -> Profile:
+        self._profile = Profile(self.memory)
+        self._started = self.memory and not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        self._token = _ACTIVE.set(self._profile)
+        return self._profile
+
+    def __exit__(self, *args: object) -> None:
+        _ACTIVE.reset(self._token)
+        if self._started:
+            tracemalloc.stop()
+
+
+def _report_at_exit(target: str) -> None:
+    if _GLOBAL is None or not _GLOBAL.stages:
+        return
+    if target == "1":
+        logger.warning("UAVision stage report\n%s", _GLOBAL)
+    else:
+        _GLOBAL.to_json(target)
+
+
+def _enable_from_env() -> None:
+    global _GLOBAL
+    target = os.environ.get(ENV_VAR, "")
+    # worker processes inherit the variable and import this module again when
+    # spawned, only the main process reports
+    if target in ("", "0") or multiprocessing.current_process().name != "MainProcess":
+        return
+    _GLOBAL = Profile(memory=True)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    atexit.register(_report_at_exit, target)
+
+
+_enable_from_env()
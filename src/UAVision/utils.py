@@ -1,5 +1,12 @@
+import hashlib
+import math
+from os import PathLike
+from typing import Any, Literal
+
 import numpy as np
+import pandas as pd
 from numpy.typing import NDArray
+from pandas.tseries.api import guess_datetime_format as _guess_format
 
 
 def calculate_binedges(midbin: NDArray[np.float64]) -> NDArray[np.float64]:
@@ -26,3 +33,312 @@ def calculate_midbin(binedges: NDArray[np.float64]) -> NDArray[np.float64]:
 
     midbin = (binedges[1:] + binedges[:-1]) / 2
     return midbin
+
+
+def guess_datetime_format(values: pd.Series, sample: int = 100) -> str | None:
+    """
+    Detect the format of datetime strings, to parse them with an explicit format
+    values: series of datetime strings
+    sample: number of leading non-null values checked against pd.to_datetime
+    return: strftime format string, or None if no single format fits the sample
+    """
+    values = values.dropna().iloc[:sample].astype(str)
+    if values.empty:
+        return None
+    fmt = _guess_format(values.iloc[0])
+    if fmt is None:
+        return None
+    try:
+        parsed = pd.to_datetime(values, format=fmt)
+        expected = pd.to_datetime(values)
+    except (ValueError, TypeError):
+        return None
+    if not parsed.equals(expected):
+        return None
+    return fmt
+
+
+def parse_datetime(values: pd.Series, format: str | None = None) -> pd.Series:
+    """
+    Parse datetime strings with an explicit format
+    values: series of datetime strings
+    format: strftime format, e.g. from guess_datetime_format. If None it is guessed
+    return: datetime series, same as pd.to_datetime(values)
+    """
+    if format is None:
+        format = guess_datetime_format(values)
+    if format is not None:
+        try:
+            return pd.to_datetime(values, format=format)
+        except ValueError:
+            pass
+    return pd.to_datetime(values)
+
+
+def parse_time_of_day(time: pd.Series) -> pd.Series:
+    """
+    Parse time of day strings to timedelta, with a vectorized fast path for
+    fixed-width 'HH:MM:SS[.f]' strings
+    time: series of time of day strings
+    return: timedelta series, same as pd.to_timedelta(time.astype(str))
+    """
+    arr = time.to_numpy().astype(str)
+    width = arr.dtype.itemsize // 4
+    if arr.size and 8 <= width <= 18:
+        codes = arr.view(np.uint32).reshape(arr.size, width)
+        digit_pos = [0, 1, 3, 4, 6, 7] + list(range(9, width))
+        digits = codes[:, digit_pos].astype(np.int64) - ord("0")
+        fixed_width = (
+            (codes[:, -1] != 0).all()
+            and (codes[:, 2] == ord(":")).all()
+            and (codes[:, 5] == ord(":")).all()
+            and (width == 8 or (codes[:, 8] == ord(".")).all())
+            and ((digits >= 0) & (digits <= 9)).all()
+        )
+        if fixed_width and width - 9 <= 9:
+            seconds = (
+                (digits[:, 0] * 10 + digits[:, 1]) * 3600
+                + (digits[:, 2] * 10 + digits[:, 3]) * 60
+                + digits[:, 4] * 10
+                + digits[:, 5]
+            )
+            fraction = np.zeros(arr.size, dtype=np.int64)
+            for j in range(6, digits.shape[1]):
+                fraction = fraction * 10 + digits[:, j]
+            ns = seconds * 1_000_000_000 + fraction * 10 ** (9 - max(width - 9, 0))
+            return pd.Series(pd.to_timedelta(ns, unit="ns"), index=time.index)
+    return pd.to_timedelta(pd.Series(arr, index=time.index))
+
+
+def guess_date_format(
+    date: pd.Series, time: pd.Series, sample: int = 100
+) -> str | None:
+    """
+    Detect the format of the date column of split date and time columns
+    date: series of date strings
+    time: series of time of day strings (HH:MM:SS[.f])
+    sample: number of leading rows checked against parsing 'date time' strings
+    return: strftime format of the date, or None if combine_date_time can not
+            be used for these columns
+    """
+    if pd.api.types.is_numeric_dtype(time) or pd.api.types.is_numeric_dtype(date):
+        return None
+    date = date.iloc[:sample]
+    time = time.iloc[:sample]
+    fmt = guess_datetime_format(date, sample)
+    if fmt is None or date.isna().any() or time.isna().any():
+        return None
+    try:
+        combined = pd.to_datetime(date, format=fmt) + parse_time_of_day(time)
+        expected = pd.to_datetime(date.astype(str) + " " + time.astype(str))
+    except (ValueError, TypeError):
+        return None
+    if not combined.equals(expected):
+        return None
+    return fmt
+
+
+def combine_date_time(
+    date: pd.Series, time: pd.Series, date_format: str | None = None
+) -> pd.Series:
+    """
+    Combine split date and time of day columns to datetime, by adding the parsed
+    time of day to the parsed date instead of concatenating strings
+    date: series of date strings
+    time: series of time of day strings (HH:MM:SS[.f])
+    date_format: strftime format of date, e.g. from guess_date_format.
+                 If None it is guessed
+    return: datetime series, same as pd.to_datetime(date + " " + time)
+    """
+    if date_format is None:
+        date_format = guess_date_format(date, time)
+    if date_format is not None:
+        try:
+            return pd.to_datetime(date, format=date_format) + parse_time_of_day(time)
+        except (ValueError, TypeError):
+            pass
+    return pd.to_datetime(date.astype(str) + " " + time.astype(str))
+
+
+def file_sha256(path: str | PathLike[str]) -> str:
+    """
+    sha256 of the content of a file, read in blocks
+    path: file path (string or PathLike)
+    return: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# largest relative error of a float64 value stored as float32 (unit roundoff)
+FLOAT32_RTOL = 2.0**-24
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Store float64 columns as float32 and integer columns as the smallest integer
+    type holding their values, other columns (e.g. datetime) are kept.
+    A stored float value x32 of x differs by |x32 - x| <= FLOAT32_RTOL * |x|
+    (for |x| within the float32 normal range, about 1.2e-38 to 3.4e38).
+    The cast happens after the float64 computation, so it shrinks the result
+    and what is kept or saved, not the peak memory of computing it
+    df: dataframe
+    return: dataframe with compact dtypes
+    """
+    dtypes = {}
+    for name, dtype in df.dtypes.items():
+        if dtype == np.float64:
+            dtypes[name] = np.float32
+        elif isinstance(dtype, np.dtype) and dtype.kind in "iu" and len(df) > 0:
+            values = df[name].to_numpy()
+            low, high = values.min(), values.max()
+            kinds = (np.uint8, np.uint16, np.uint32) if low >= 0 else ()
+            for kind in (*kinds, np.int8, np.int16, np.int32):
+                if np.iinfo(kind).min <= low and high <= np.iinfo(kind).max:
+                    dtypes[name] = kind
+                    break
+    return df.astype(dtypes) if dtypes else df
+
+
+def _bucket_first(
+    values: NDArray[Any], valid: NDArray[np.bool_], bucket: NDArray[np.intp], n: int
+) -> NDArray[Any]:
+    # first valid value of each bucket, NaN for float buckets without one
+    out = np.full(n, np.nan) if values.dtype.kind == "f" else np.empty(n, values.dtype)
+    rows = np.flatnonzero(valid)
+    b = bucket[rows]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = b[1:] != b[:-1]
+    out[b[first]] = values[rows[first]]
+    return out
+
+
+def _bucket_add(
+    x: NDArray[np.float64], starts: NDArray[np.intp], bucket: NDArray[np.intp]
+) -> NDArray[np.float64]:
+    # sum of each bucket, reduceat is faster for long buckets and bincount
+    # for many short ones
+    if len(x) >= 8 * len(starts):
+        return np.add.reduceat(x, starts) if len(starts) else np.zeros(0)
+    return np.bincount(bucket, x, minlength=len(starts)).astype(np.float64)
+
+
+def _bucket_sum(
+    values: NDArray[np.float64],
+    valid: NDArray[np.bool_],
+    starts: NDArray[np.intp],
+    bucket: NDArray[np.intp],
+    count: NDArray[np.int64],
+) -> NDArray[np.float64]:
+    # sum of the valid values of each bucket, correctly rounded unless values
+    # far below the largest of the column cancel: each value is split at a
+    # power of two sigma above any bucket sum into a high part, whose sums are
+    # exact in any order, and a small remainder (ExtractVector of Rump, Ogita
+    # and Oishi). Never less accurate than a plain sum
+    x = values
+    if not valid.all():
+        x = values.copy()
+        x[~valid] = 0.0
+    most = int(count.max(initial=0))
+    if most <= 2:
+        # sums of one or two values are correctly rounded already
+        return _bucket_add(x, starts, bucket)
+    largest = max(float(x.max()), -float(x.min()))
+    exponent = math.frexp(largest)[1] + math.frexp(most)[1]
+    if not math.isfinite(largest) or exponent > 1023:
+        # infinite values and values near the float64 range are summed directly
+        return _bucket_add(x, starts, bucket)
+    sigma = math.ldexp(1.0, exponent)
+    high = x + sigma
+    high -= sigma
+    low = x - high
+    return _bucket_add(high, starts, bucket) + _bucket_add(low, starts, bucket)
+
+
+def resample_sparse(
+    df: pd.DataFrame,
+    on: str = "datetime",
+    period: str | pd.Timedelta = "1s",
+    how: Literal["mean", "sum", "count", "first"] = "mean",
+) -> pd.DataFrame:
+    """
+    Resample to a fixed period aggregating only the occupied periods, instead
+    of building a regular grid over the whole time span like
+    DataFrame.resample, so time and memory grow with the number of rows and
+    not with the time span. Periods start at multiples of period (as
+    Series.dt.floor), missing values are skipped and rows with NaT are dropped.
+    For a period dividing a day the result equals
+    df.set_index(on).resample(period).<how>().reset_index() without the
+    unoccupied periods. Sums are correctly rounded, the compensated sums of
+    pandas of more than two values may differ from them in the last bit
+    df: dataframe with a datetime column and numeric columns
+    on: name of the datetime column (default 'datetime')
+    period: period string or Timedelta, a whole number of units of the
+            datetime column (default '1s')
+    how: 'mean', 'sum', 'count' (non-missing values) or 'first' (first
+         non-missing value) (default 'mean')
+    return: dataframe of on (start of each occupied period) and the
+            aggregated columns, sorted by time
+    """
+    if how not in ("mean", "sum", "count", "first"):
+        raise ValueError(f"how must be 'mean', 'sum', 'count' or 'first', got {how!r}")
+    datetime = pd.DatetimeIndex(df[on])
+    unit = datetime.unit
+    step = pd.Timedelta(period) / pd.Timedelta(1, unit=unit)
+    if step <= 0 or step != int(step):
+        raise ValueError(f"period {period!r} is not a whole number of {unit}")
+    columns = [x for x in df.columns if x != on]
+    frame = df[columns]
+    # UTC ticks, to_numpy of tz-aware datetimes gives Timestamp objects
+    naive = datetime if datetime.tz is None else datetime.tz_convert(None)
+    ticks = naive.to_numpy().view(np.int64)
+    if datetime.hasnans:
+        keep = ~np.asarray(datetime.isna())
+        ticks = ticks[keep]
+        frame = frame[keep]
+    if (ticks[1:] < ticks[:-1]).any():
+        # resample sorts by time, a stable sort keeps the order of equal times
+        order = np.argsort(ticks, kind="stable")
+        ticks = ticks[order]
+        frame = frame.take(order)
+    floored = ticks - ticks % int(step)
+    new = np.ones(len(floored), dtype=bool)
+    new[1:] = floored[1:] != floored[:-1]
+    starts = np.flatnonzero(new)
+    n = len(starts)
+    lengths = np.diff(np.append(starts, len(floored)))
+    bucket = np.repeat(np.arange(n), lengths)
+
+    index = pd.DatetimeIndex(floored[starts].view(f"M8[{unit}]"))
+    if datetime.tz is not None:
+        index = index.tz_localize("UTC").tz_convert(datetime.tz)
+    result: dict[Any, Any] = {on: index}
+    for name in columns:
+        values = frame[name].to_numpy()
+        if values.dtype.kind not in "biuf":
+            raise TypeError(f"column {name!r} of dtype {values.dtype} is not numeric")
+        if values.dtype.kind == "b":
+            values = values.astype(np.int64)
+        if values.dtype.kind == "f":
+            valid = ~np.isnan(values)
+            count = lengths - np.bincount(bucket[~valid], minlength=n)
+        else:
+            valid = np.ones(len(values), dtype=bool)
+            count = lengths
+        if how == "count":
+            result[name] = count
+        elif how == "first":
+            result[name] = _bucket_first(values, valid, bucket, n)
+        elif how == "sum" and values.dtype.kind != "f":
+            result[name] = np.add.reduceat(values, starts) if n else values[:0]
+        else:
+            total = _bucket_sum(values.astype(np.float64), valid, starts, bucket, count)
+            if how == "sum":
+                result[name] = total
+            else:
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result[name] = total / count
+    return pd.DataFrame(result)
@@ -0,0 +1,117 @@
+"""
+compact=True outputs against the float64 outputs, on the synthetic inputs of
+benchmarks/generators.py: every float value is within FLOAT32_RTOL, and
+within twice that for values derived again from float32 columns or written
+to csv as the shortest float32 decimal.
+"""
+
+import os
+from pathlib import Path
+
+import generators
+import numpy as np
+import pandas as pd
+import pytest
+
+from UAVision.bme.preprocess import preprocess_bme
+from UAVision.columnar import load_columnar
+from UAVision.cpc.preprocess import preprocess_cpc
+from UAVision.mavic.merge_sensor_data import OutputFormat, merge_sensor_data
+from UAVision.mcda.preprocess import dndlog_mcda, preprocess_mcda
+from UAVision.pops.preprocess import dndlog_pops, preprocess_pops
+from UAVision.utils import FLOAT32_RTOL
+
+DURATION = 600
+SIZE = "water_0.6-40"
+
+
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory: pytest.TempPathFactory) -> dict[str, str]:
+    return generators.generate(tmp_path_factory.mktemp("inputs"), DURATION)
+
+
+def relative_error(compact: pd.DataFrame, full: pd.DataFrame) -> float:
+    """
+    Largest |x32 - x64| / |x64| over the float64 columns of full, 0 / 0 as 0,
+    missing values must be missing in both
+    """
+    assert list(compact.columns) == list(full.columns)
+    error = 0.0
+    for name in full.columns:
+        if full[name].dtype != np.float64:
+            pd.testing.assert_series_equal(compact[name], full[name], check_dtype=False)
+            continue
+        assert compact[name].dtype == np.float32, name
+        x = full[name].to_numpy()
+        x32 = compact[name].to_numpy(dtype=np.float64)
+        np.testing.assert_array_equal(np.isnan(x32), np.isnan(x), err_msg=name)
+        ok = ~np.isnan(x) & (x != 0)
+        np.testing.assert_array_equal(x32[x == 0], 0, err_msg=name)
+        error = max(error, float((np.abs(x32 - x)[ok] / np.abs(x[ok])).max(initial=0)))
+    return error
+
+
+def test_cpc(paths: dict[str, str]) -> None:
+    full = preprocess_cpc(paths["cpc"])
+    assert relative_error(preprocess_cpc(paths["cpc"], compact=True), full) <= (
+        FLOAT32_RTOL
+    )
+
+
+def test_bme(paths: dict[str, str]) -> None:
+    full = preprocess_bme(paths["bme"])
+    assert relative_error(preprocess_bme(paths["bme"], compact=True), full) <= (
+        FLOAT32_RTOL
+    )
+
+
+def test_pops(paths: dict[str, str]) -> None:
+    full = preprocess_pops(paths["pops"])
+    compact = preprocess_pops(paths["pops"], compact=True, include_dndlog=False)
+    dndlog = [x for x in full.columns if "dN/dlogDp" in x]
+    assert relative_error(compact, full.drop(columns=dndlog)) <= FLOAT32_RTOL
+    # computed again from the float32 concentrations
+    assert relative_error(dndlog_pops(compact), full[dndlog]) <= 2 * FLOAT32_RTOL
+
+
+def test_mcda(paths: dict[str, str]) -> None:
+    full = preprocess_mcda(paths["mcda"], SIZE)
+    compact = preprocess_mcda(paths["mcda"], SIZE, compact=True, include_dndlog=False)
+    dndlog = [x for x in full.columns if "dN/dlogDp" in x]
+    assert relative_error(compact, full.drop(columns=dndlog)) <= FLOAT32_RTOL
+    assert relative_error(dndlog_mcda(compact, SIZE), full[dndlog]) <= (
+        2 * FLOAT32_RTOL
+    )
+
+
+@pytest.mark.parametrize("output_format", ["csv", "npy"])
+def test_merge_sensor_data(
+    paths: dict[str, str], tmp_path: Path, output_format: OutputFormat
+) -> None:
+    merged = {}
+    for compact in (False, True):
+        dir_out = os.path.join(tmp_path, f"compact_{compact}")
+        os.makedirs(dir_out)
+        failed = merge_sensor_data(
+            paths["sensor_tree"], dir_out, output_format, compact=compact
+        )
+        assert not failed
+        merged[compact] = sorted(os.listdir(dir_out))
+    assert merged[True] == merged[False]
+    for name in merged[True]:
+        dfs = {}
+        for compact in (False, True):
+            path = os.path.join(tmp_path, f"compact_{compact}", name)
+            if output_format == "csv":
+                dfs[compact] = pd.read_csv(path)
+            else:
+                dfs[compact] = load_columnar(path, mmap=False)
+        if output_format == "csv":
+            # the shortest decimal of the float32 is read back as float64
+            dfs[True] = dfs[True].astype(
+                {x: np.float32 for x in dfs[True] if dfs[True][x].dtype == np.float64}
+            )
+            bound = 2 * FLOAT32_RTOL
+        else:
+            bound = FLOAT32_RTOL
+        assert relative_error(dfs[True], dfs[False]) <= bound
@@ -0,0 +1,53 @@
+"""
+fuse against pandas.merge_asof on the time base of one product
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from UAVision.fusion import fuse
+
+
+@pytest.fixture(scope="module")
+def products() -> dict[str, pd.DataFrame]:
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2023-05-01 10:00").as_unit("ns")
+    a = pd.DataFrame(
+        {
+            "datetime": start + pd.to_timedelta(np.arange(0, 600, 1.0), unit="s"),
+            "a": rng.normal(size=600),
+        }
+    )
+    b = pd.DataFrame(
+        {
+            "datetime": start
+            + pd.to_timedelta(np.sort(rng.uniform(-5, 605, 200)), unit="s"),
+            "b": rng.normal(size=200),
+        }
+    )
+    return {"a": a, "b": b}
+
+
+def expected(products: dict[str, pd.DataFrame], name: str, direction: str) -> pd.Series:
+    return pd.merge_asof(
+        products["a"][["datetime"]],
+        products[name],
+        on="datetime",
+        direction=direction,
+    )[name]
+
+
+@pytest.mark.parametrize("method", ["nearest", "backward", "forward"])
+def test_method(products: dict[str, pd.DataFrame], method: str) -> None:
+    fused = fuse(products, base="a", method=method)
+    pd.testing.assert_series_equal(fused["b"], expected(products, "b", method))
+
+
+def test_partial_method_mapping(products: dict[str, pd.DataFrame]) -> None:
+    # instruments left out of the mapping are matched to the nearest time
+    fused = fuse(products, base="a", method={"b": "backward"})
+    pd.testing.assert_series_equal(fused["a"], products["a"]["a"])
+    pd.testing.assert_series_equal(fused["b"], expected(products, "b", "backward"))
+    fused = fuse(products, base="a", method={"a": "forward"})
+    pd.testing.assert_series_equal(fused["b"], expected(products, "b", "nearest"))
@@ -0,0 +1,74 @@
+"""
+resample_sparse against DataFrame.resample on the occupied periods, for rows
+out of time order, repeated times and missing values
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from UAVision.utils import resample_sparse
+
+PERIOD = "1s"
+
+
+@pytest.fixture(scope="module")
+def df() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 2000
+    # ~4 rows per period over gaps of several periods, shuffled, with repeats
+    ticks = rng.integers(0, n // 4, n) * 10**9 + rng.integers(0, 4, n) * 250_000_000
+    ticks[rng.integers(0, n, n // 10)] = ticks[0]
+    x = rng.normal(size=n)
+    x[rng.random(n) < 0.2] = np.nan
+    return pd.DataFrame(
+        {
+            "datetime": pd.Timestamp("2023-05-01 10:00") + pd.to_timedelta(ticks),
+            "x": x,
+            "y": rng.integers(0, 100, n).astype(float),
+        }
+    )
+
+
+def expected(df: pd.DataFrame, how: str) -> pd.DataFrame:
+    occupied = df["datetime"].dt.floor(PERIOD).unique()
+    resampled = getattr(df.set_index("datetime").resample(PERIOD), how)()
+    return resampled.loc[np.sort(occupied)].reset_index()
+
+
+@pytest.mark.parametrize("how", ["first", "count"])
+def test_exact(df: pd.DataFrame, how: str) -> None:
+    pd.testing.assert_frame_equal(
+        resample_sparse(df, period=PERIOD, how=how),
+        expected(df, how),
+        check_dtype=False,
+        check_index_type=False,
+    )
+
+
+@pytest.mark.parametrize("how", ["mean", "sum"])
+def test_close(df: pd.DataFrame, how: str) -> None:
+    # the compensated sums of pandas may differ in the last bit
+    pd.testing.assert_frame_equal(
+        resample_sparse(df, period=PERIOD, how=how),
+        expected(df, how),
+        check_dtype=False,
+        check_index_type=False,
+        rtol=1e-12,
+    )
+
+
+def test_unsorted_first() -> None:
+    df = pd.DataFrame(
+        {
+            "datetime": pd.to_datetime(
+                [
+                    "2023-05-01 00:00:00.7",
+                    "2023-05-01 00:00:00.2",
+                    "2023-05-01 00:00:01.1",
+                ]
+            ),
+            "x": [1.0, 2.0, 3.0],
+        }
+    )
+    assert resample_sparse(df, how="first")["x"].tolist() == [2.0, 3.0]